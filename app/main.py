@@ -1,17 +1,27 @@
 import asyncio
+import os
 
 import httpx
 from authlib.integrations.requests_client import OAuth2Session
 from google.adk.agents import Agent
 from google.adk.sessions import VertexAiSessionService
-from google.adk.tools import FunctionTool, ToolContext
+from google.adk.tools import ToolContext
 from oauth.oauth import OAuthApp
 from util.agent.agent import AgentClient
+from util.cache.cache import TTLCache
 from util.config.config import Config
 from util.credential.credential import Credential
 from util.envelope.envelope_aead import EnvelopeAEAD
+from util.lifecycle.lifecycle import InflightTracker
+from util.resilience.resilience import Dependency
+from util.telemetry.telemetry import telemetry
+from util.tool.tool import BoundedFunctionTool, ToolConcurrencyLimiter
 
 config = Config()
+telemetry.enabled = config.telemetry_enabled
+if config.web_concurrency > 1:
+    # Each worker keeps and serves its own metrics
+    telemetry.const_labels["worker"] = str(os.getpid())
 
 # https://google.github.io/adk-docs/sessions/state/#organizing-state-with-prefixes-scope-matters
 # Using 'user:' prefix for proper scoping and persistence:
@@ -21,29 +31,88 @@ config = Config()
 USER_GOOGLE_STATE_KEY = "user:google"
 
 credential: Credential = Credential(
-    envelope_aead=EnvelopeAEAD(kek_uri=config.gcp_kms_key_uri),
+    envelope_aead=EnvelopeAEAD(
+        kek_uri=config.gcp_kms_key_uri,
+        previous_kek_uris=config.gcp_kms_previous_key_uris,
+        dek_cache_ttl=config.dek_cache_ttl,
+        write_compact=config.compact_token_format,
+    ),
     oauth_session=OAuth2Session(
         client_id=config.google_client_id,
         client_secret=config.google_client_secret,
         token_endpoint="https://oauth2.googleapis.com/token",
+        default_timeout=3.0,
     ),
+    # Pre-warmed access tokens have to outlive the request that fetched them
+    access_token_cache_size=1024 if config.credential_prewarm else 0,
+)
+
+# Shared across tool calls so connections to Google APIs are pooled
+http_client: httpx.AsyncClient = httpx.AsyncClient()
+
+# Userinfo responses keyed by user_id, only kept when credentials are
+# pre-warmed; a TTL of 0 makes every tool call fetch a fresh profile
+userinfo_cache: TTLCache[str, dict] = TTLCache(
+    "userinfo", ttl=config.userinfo_cache_ttl if config.credential_prewarm else 0
+)
+
+
+def _is_transient_http_error(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)
+
+
+userinfo_dependency: Dependency = Dependency(
+    "userinfo", timeout=3.0, retryable=_is_transient_http_error
 )
 
 
+async def _get_user_info(access_token: str) -> dict:
+    response = await http_client.get(
+        "https://www.googleapis.com/oauth2/v2/userinfo",
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+async def fetch_user_info(user_id: str, access_token: str) -> dict:
+    with telemetry.span("userinfo_fetch"):
+        user_info = await userinfo_dependency.call(
+            lambda: _get_user_info(access_token)
+        )
+    if userinfo_cache.ttl > 0:
+        userinfo_cache.set(user_id, user_info)
+    return user_info
+
+
+async def prewarm_user_credentials(user_id: str, encrypted_token: str) -> None:
+    """Fill the access token and userinfo caches before the first tool call"""
+    await credential.prewarm(user_id, encrypted_token)
+    if userinfo_cache.get(user_id, record=False) is not None:
+        return
+
+    access_token = await credential.get_access_token(
+        user_id, encrypted_token, record=False
+    )
+    if access_token:
+        await fetch_user_info(user_id, access_token)
+
+
 async def get_user_profile_tool(tool_context: ToolContext, requires_email: bool) -> str:
-    access_token = credential.get_access_token_from_context(
+    user_id = tool_context._invocation_context.user_id
+    # Resolve the credential first; without pre-warming nothing is cached, so
+    # a revoked or undecryptable token never gets a profile
+    access_token = await credential.get_access_token_from_context(
         tool_context=tool_context, state_key=USER_GOOGLE_STATE_KEY
     )
     if not access_token:
         return "Failed to obtain access token"
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            "https://www.googleapis.com/oauth2/v2/userinfo",
-            headers={"Authorization": f"Bearer {access_token}"},
-        )
-        response.raise_for_status()
-        user_info = response.json()
+    user_info = userinfo_cache.get(user_id)
+    if user_info is None:
+        user_info = await fetch_user_info(user_id, access_token)
 
     if requires_email:
         return f"User profile: Name={user_info.get('name')}, Email={user_info.get('email')}"
@@ -51,16 +120,27 @@ async def get_user_profile_tool(tool_context: ToolContext, requires_email: bool)
     return f"User profile: Name={user_info.get('name')}"
 
 
+# Function calls of one model turn run concurrently up to this limit; they
+# share the invocation's credential memo, so only one of them refreshes
+tool_limiter = ToolConcurrencyLimiter(config.tool_concurrency)
+
 agent = Agent(
     name="agent",
     model="gemini-2.5-flash",
     description="Agent to answer questions.",
     instruction="I can answer your questions by my own knowledge and available tools. Just ask me anything!",
     tools=[
-        FunctionTool(get_user_profile_tool),
+        BoundedFunctionTool(get_user_profile_tool, limiter=tool_limiter),
     ],
+    before_model_callback=telemetry.before_model_callback,
+    after_model_callback=telemetry.after_model_callback,
+    after_agent_callback=credential.clear_invocation,
 )
 
+# Tracks in-flight runs and background work such as session compaction so
+# they can be drained on shutdown
+inflight = InflightTracker()
+
 # https://google.github.io/adk-docs/sessions/session/#sessionservice-implementations
 agent_client = AgentClient(
     session_service=VertexAiSessionService(
@@ -69,6 +149,10 @@ agent_client = AgentClient(
     ),
     app_name=config.app_name,
     agent=agent,
+    compaction_max_events=config.session_compaction_max_events or None,
+    compaction_token_budget=config.session_compaction_token_budget or None,
+    compaction_keep_events=config.session_compaction_keep_events,
+    spawn=inflight.spawn,
 )
 
 # Initialize OAuth app
@@ -79,6 +163,11 @@ oauth_app = OAuthApp(
     iap_audience=config.iap_audience,
     scope="openid email profile",
     state_key=USER_GOOGLE_STATE_KEY,
+    http_client=http_client,
+    inflight=inflight,
+    credential_prewarmer=(
+        prewarm_user_credentials if config.credential_prewarm else None
+    ),
 )
 
 
@@ -88,4 +177,12 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if config.web_concurrency > 1:
+        # Spawned workers re-run this script as __main__ before importing the
+        # app, so "__main__" resolves to that per-worker module instead of
+        # building a second copy of every client.
+        oauth_app.run_workers(
+            "__main__:oauth_app.app", workers=config.web_concurrency
+        )
+    else:
+        asyncio.run(main())
@@ -1,19 +1,49 @@
 #!/usr/bin/env python3
 """OAuth and web application management."""
 
+import asyncio
 import html
-from typing import Optional, TypedDict
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypedDict
 
+import httpx
 from authlib.integrations.starlette_client import OAuth
 from authlib.integrations.starlette_client.apps import StarletteOAuth2App
 from starlette.applications import Starlette
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.requests import Request
-from starlette.responses import HTMLResponse, RedirectResponse, Response
+from starlette.responses import (
+    HTMLResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    Response,
+)
 from util.agent.agent import AgentClient
 from util.config.config import Config
 from util.credential.credential import Credential
-from util.iap.iap import IAPVerificationError, verify_iap_jwt_from_request
+from util.deadline.deadline import (
+    DeadlineExceededError,
+    RequestCancelledError,
+    RequestContext,
+    run_request,
+    wait_for_disconnect,
+)
+from util.iap.iap import (
+    IAPVerificationError,
+    verify_iap_jwt_from_request,
+    warm_up_jwks,
+)
+from util.lifecycle.lifecycle import DrainingError, InflightTracker
+from util.profiler.profiler import (
+    AllocationTrackingMiddleware,
+    ProfilerBusyError,
+    SamplingProfiler,
+)
+from util.session.session import InMemorySessionStore, ServerSideSessionMiddleware
+from util.telemetry.telemetry import new_request_id, telemetry
+
+logger = logging.getLogger(__name__)
 
 
 class GoogleUserInfo(TypedDict):
@@ -63,6 +93,9 @@ class OAuthApp:
         iap_audience: str,
         scope: str,
         state_key: str,
+        http_client: Optional[httpx.AsyncClient] = None,
+        credential_prewarmer: Optional[Callable[[str, str], Awaitable[None]]] = None,
+        inflight: Optional[InflightTracker] = None,
     ):
         """
         Initialize OAuth application with required dependencies
@@ -73,20 +106,50 @@ class OAuthApp:
             credential: Credential management instance
             iap_audience: Expected audience for IAP assertions
             state_key: State key for Google user data
+            http_client: Shared HTTP client used by tools, closed on shutdown
+            credential_prewarmer: Optional coroutine function called with the
+                user id and encrypted refresh token to warm credential caches
+            inflight: Tracker for in-flight runs and background tasks, shared
+                with components that start background work
         """
         self.config = config
         self.agent_client = agent_client
         self.credential = credential
         self.state_key = state_key
         self.iap_audience = iap_audience
+        self.http_client = http_client
+        self.credential_prewarmer = credential_prewarmer
+        self.inflight: InflightTracker = inflight or InflightTracker()
+        self.profiler: Optional[SamplingProfiler] = (
+            SamplingProfiler() if config.profiler_enabled else None
+        )
 
         # Initialize Starlette app
-        self.app: Starlette = Starlette()
-        self.app.add_middleware(
-            SessionMiddleware,
-            secret_key=config.session_secret_key,
-            https_only=True,
-        )
+        self.app: Starlette = Starlette(lifespan=self._lifespan)
+        if self.profiler is not None:
+            self.app.add_middleware(AllocationTrackingMiddleware, profiler=self.profiler)
+        if config.session_backend == "server":
+            if config.web_concurrency > 1:
+                logger.warning(
+                    "Server-side sessions are per process; "
+                    "logins may fail when WEB_CONCURRENCY > 1"
+                )
+            self.app.add_middleware(
+                ServerSideSessionMiddleware,
+                store=InMemorySessionStore(
+                    max_entries=config.session_store_max_entries,
+                    ttl=config.session_max_age,
+                ),
+                max_age=config.session_max_age,
+                https_only=True,
+            )
+        else:
+            self.app.add_middleware(
+                SessionMiddleware,
+                secret_key=config.session_secret_key,
+                max_age=config.session_max_age,
+                https_only=True,
+            )
 
         # Initialize OAuth
         self.oauth: OAuth = OAuth()
@@ -104,6 +167,61 @@ class OAuthApp:
         # Register routes
         self._register_routes()
 
+    @asynccontextmanager
+    async def _lifespan(self, app: Starlette) -> AsyncIterator[None]:
+        """Warm up per-process state before serving and drain it on shutdown"""
+        self.inflight.drain_on_signals()
+        await self.warm_up()
+        yield
+        await self.shutdown()
+
+    async def warm_up(self) -> None:
+        """
+        Fetch the IAP JWKS and open the KMS channel in this process.
+
+        Failures are logged and left to be retried on the request path.
+        """
+        results = await asyncio.gather(
+            asyncio.to_thread(warm_up_jwks),
+            asyncio.to_thread(self.credential.warm_up),
+            return_exceptions=True,
+        )
+        for name, result in zip(("jwks", "kms"), results):
+            if isinstance(result, Exception):
+                logger.warning("Warm-up of %s failed: %s", name, result)
+
+    async def shutdown(self) -> None:
+        """
+        Wait for background tasks, then close clients.
+
+        The tracker has been draining since SIGTERM, so /llm answered 503 to
+        runs arriving on open connections, and uvicorn has waited for the
+        requests still running (up to GRACEFUL_SHUTDOWN_TIMEOUT) before this
+        runs. What is left is background work started before SIGTERM (the
+        tracker refuses new background work while draining): credential
+        pre-warming and session compaction, whose session writes
+        are the only ones not made inside a request. Agent runs write their
+        events to the session service as they happen, so there is nothing
+        buffered to flush; the in-memory server-side session store is lost
+        with the process.
+        """
+        drained = await self.inflight.drain(self.config.shutdown_drain_timeout)
+        if not drained:
+            logger.warning("Shutdown deadline reached before all work finished")
+
+        if self.http_client is not None:
+            await self.http_client.aclose()
+        await asyncio.to_thread(self.credential.close)
+
+    def _prewarm_credentials(self, user_id: str, encrypted_token: Optional[str]) -> None:
+        """Warm the user's credentials in the background if enabled"""
+        if self.credential_prewarmer is None or not encrypted_token:
+            return
+        self.inflight.spawn(
+            self.credential_prewarmer(user_id, encrypted_token),
+            name=f"prewarm:{user_id}",
+        )
+
     def _register_routes(self) -> None:
         """Register all application routes"""
         self.app.add_route("/", self.index)
@@ -111,6 +229,10 @@ class OAuthApp:
         self.app.add_route("/callback", self.callback)
         self.app.add_route("/logout", self.logout)
         self.app.add_route("/llm", self.llm)
+        if self.config.telemetry_enabled:
+            self.app.add_route("/metrics", self.metrics)
+        if self.profiler is not None:
+            self.app.add_route("/debug/profile", self.profile)
 
     async def index(self, request: Request) -> Response:
         """Home page route"""
@@ -161,14 +283,14 @@ class OAuthApp:
                 "name": userinfo["name"],
             }
 
+            encrypted_token: str = self.credential.encrypt_token(
+                token["refresh_token"], userinfo["email"]
+            )
             await self.agent_client.create_session(
                 user_id=userinfo["email"],
-                state={
-                    self.state_key: self.credential.encrypt_token(
-                        token["refresh_token"], userinfo["email"]
-                    )
-                },
+                state={self.state_key: encrypted_token},
             )
+            self._prewarm_credentials(userinfo["email"], encrypted_token)
             request.session["user"] = user_session
             return RedirectResponse(url="/")
 
@@ -189,6 +311,7 @@ class OAuthApp:
 
     async def llm(self, request: Request) -> Response:
         """LLM interaction route"""
+        request_id: str = new_request_id(request.headers.get("X-Request-ID"))
         try:
             email: str = verify_iap_jwt_from_request(
                 request,
@@ -201,11 +324,93 @@ class OAuthApp:
                 status_code=400,
             )
 
+        # The run, token refreshes and tool calls are cancelled once the
+        # client disconnects or the request deadline passes
+        context = RequestContext(self.config.request_timeout or None)
+        try:
+            async with self.inflight.track():
+                response: str = await run_request(
+                    self._respond(email),
+                    context,
+                    disconnected=lambda: wait_for_disconnect(request.receive),
+                )
+        except DrainingError:
+            return HTMLResponse(
+                "<h2>Error:</h2><p>Server is shutting down, please retry</p>",
+                status_code=503,
+                headers={"Retry-After": "1"},
+            )
+        except DeadlineExceededError:
+            return HTMLResponse(
+                "<h2>Error:</h2><p>The request timed out</p>",
+                status_code=504,
+                headers={"X-Request-ID": request_id},
+            )
+        except RequestCancelledError:
+            # Nobody is listening, the status only shows up in access logs
+            return Response(status_code=499)
+        return HTMLResponse(
+            f"<h2>LLM Response:</h2><p>{html.escape(response)}</p>",
+            headers={"X-Request-ID": request_id},
+        )
+
+    async def _respond(self, email: str) -> str:
+        """Run the agent for the user under the current request context"""
         agent_session = await self.agent_client.get_or_create_session(email)
-        response: str = await agent_session.get_response(
-            "Please use get_user_profile_tool to fetch user profile information with email address."
+        self._prewarm_credentials(email, agent_session.session.state.get(self.state_key))
+        with self.credential.invocation_scope():
+            return await agent_session.get_response(
+                "Please use get_user_profile_tool to fetch user profile information with email address."
+            )
+
+    async def metrics(self, request: Request) -> Response:
+        """Prometheus metrics route"""
+        return PlainTextResponse(
+            telemetry.render_prometheus(),
+            media_type="text/plain; version=0.0.4",
         )
-        return HTMLResponse(f"<h2>LLM Response:</h2><p>{html.escape(response)}</p>")
+
+    async def profile(self, request: Request) -> Response:
+        """
+        Admin profiling route
+
+        Samples stacks for ``seconds`` (default 10) and returns them in the
+        collapsed format for flame graphs. With ``mode=allocations`` it
+        returns per-route allocation statistics for that window instead.
+        """
+        try:
+            email: str = verify_iap_jwt_from_request(
+                request,
+                audience=self.iap_audience,
+            )
+        except IAPVerificationError as e:
+            logger.warning("Failed to verify IAP JWT for profiling: %s", e)
+            return PlainTextResponse("Failed to verify IAP JWT", status_code=400)
+        if email.lower() not in self.config.admin_emails:
+            return PlainTextResponse("Forbidden", status_code=403)
+
+        try:
+            seconds = float(request.query_params.get("seconds", "10"))
+        except ValueError:
+            return PlainTextResponse("Invalid seconds", status_code=400)
+        if not 0 < seconds <= self.profiler.max_seconds:
+            return PlainTextResponse(
+                f"seconds must be in (0, {self.profiler.max_seconds:g}]",
+                status_code=400,
+            )
+
+        mode = request.query_params.get("mode", "cpu")
+        logger.info("Profiling mode=%s seconds=%s requested_by=%s", mode, seconds, email)
+        try:
+            if mode == "cpu":
+                body = await self.profiler.profile(seconds)
+            elif mode == "allocations":
+                body = await self.profiler.profile_allocations(seconds)
+            else:
+                return PlainTextResponse("Unknown mode", status_code=400)
+        except ProfilerBusyError:
+            return PlainTextResponse("A profile is already running", status_code=409)
+        return PlainTextResponse(body)
 
     async def start(self, host: str = "0.0.0.0", port: Optional[int] = None) -> None:
         """
@@ -220,6 +425,45 @@ class OAuthApp:
         if port is None:
             port = self.config.port
 
-        config = uvicorn.Config(self.app, host=host, port=port)
+        config = uvicorn.Config(
+            self.app,
+            host=host,
+            port=port,
+            timeout_graceful_shutdown=self.config.graceful_shutdown_timeout,
+        )
         server = uvicorn.Server(config)
         await server.serve()
+
+    def run_workers(
+        self,
+        app_import: str,
+        workers: int,
+        host: str = "0.0.0.0",
+        port: Optional[int] = None,
+    ) -> None:
+        """
+        Start web server with multiple worker processes
+
+        Each worker is a spawned process that imports the application itself,
+        so secrets, the JWKS cache and crypto clients are created and warmed
+        per worker, and nothing is shared between them. On SIGTERM every
+        worker stops accepting connections and drains in-flight requests.
+
+        Args:
+            app_import: Import string of the Starlette app (e.g. "main:app")
+            workers: Number of worker processes
+            host: Host address to bind to
+            port: Port number to bind to (defaults to config.port if not specified)
+        """
+        import uvicorn
+
+        if port is None:
+            port = self.config.port
+
+        uvicorn.run(
+            app_import,
+            host=host,
+            port=port,
+            workers=workers,
+            timeout_graceful_shutdown=self.config.graceful_shutdown_timeout,
+        )
@@ -5,16 +5,42 @@ ADK Agent client for managing sessions and interactions
 
 from __future__ import annotations
 
+import asyncio
 import logging
-from typing import AsyncGenerator, Optional
+from typing import AsyncGenerator, Awaitable, Callable, Coroutine, Optional
 
 from google.adk.agents import Agent
+from google.adk.events import EventActions
 from google.adk.runners import Event, Runner
 from google.adk.sessions import Session, VertexAiSessionService
 from google.genai import types
+from util.cache.cache import TTLCache
+from util.deadline.deadline import (
+    DeadlineExceededError,
+    RequestCancelledError,
+    check_request,
+)
+from util.telemetry.telemetry import current_request_id, telemetry
 
 logger = logging.getLogger(__name__)
 
+# State that is not copied into a compacted session: temp: values belong to
+# one invocation, and user: and app: values are stored once per user or app
+# and merged into every session when it is loaded; writing a snapshot of them
+# back could overwrite newer values, such as a refresh token from a new login
+_UNCOPIED_STATE_PREFIXES = ("temp:", "user:", "app:")
+
+# Session state of a compacted session naming the session that replaced it,
+# so every process resolves the old id the same way
+_COMPACTED_INTO_KEY = "compacted_into"
+
+# Compaction replacements followed when loading a session
+_MAX_COMPACTION_HOPS = 8
+
+_COMPACTED_EVENTS = "adk_session_compacted_events_total"
+
+telemetry.describe(_COMPACTED_EVENTS, "Session events dropped by compaction.")
+
 
 class AgentClientError(Exception):
     """Custom exception for AgentClient errors."""
@@ -28,47 +54,100 @@ _RESPONSE_ERROR = "Sorry, an internal error occurred while processing the respon
 class AgentSession:
     """Manages an agent session with conversation state."""
 
-    def __init__(self, session: Session, runner: Runner, user_id: str) -> None:
+    def __init__(
+        self,
+        session: Session,
+        runner: Runner,
+        user_id: str,
+        on_response: Optional[Callable[[AgentSession], None]] = None,
+    ) -> None:
         self.session: Session = session
         self.runner: Runner = runner
         self.user_id: str = user_id
+        self.on_response = on_response
+        # Events the runs added to the session since ``session`` was loaded
+        self.new_events: list[Event] = []
 
     @property
     def session_id(self) -> str:
         return self.session.id
 
     async def get_response(self, query: str) -> str:
-        """Execute the agent and get response."""
+        """
+        Execute the agent and get response.
+
+        Stops between events once the current request is cancelled or past
+        its deadline.
+
+        Raises:
+            DeadlineExceededError: The request deadline passed
+            RequestCancelledError: The request was cancelled
+        """
+        try:
+            return await self._run(query)
+        finally:
+            if self.on_response is not None:
+                self.on_response(self)
+
+    async def _run(self, query: str) -> str:
         try:
             content = types.Content(role="user", parts=[types.Part(text=query)])
-            events: AsyncGenerator[Event, None] = self.runner.run_async(
-                user_id=self.user_id, session_id=self.session.id, new_message=content
+            self.new_events.append(
+                Event(invocation_id="", author="user", content=content)
             )
+            with telemetry.span("agent_run"):
+                events: AsyncGenerator[Event, None] = self.runner.run_async(
+                    user_id=self.user_id, session_id=self.session.id, new_message=content
+                )
 
-            async for event in events:
-                if event.is_final_response():
-                    try:
-                        final_response: str = event.content.parts[0].text
-                        return final_response
-                    except Exception:
-                        logger.exception(
-                            "Failed to extract final response user_id=%s session_id=%s",
-                            self.user_id,
-                            self.session.id,
-                        )
-                        return _RESPONSE_ERROR
+                # Run to the end so after-agent and after-run callbacks fire
+                final_event: Optional[Event] = None
+                async for event in events:
+                    if not event.partial:
+                        self.new_events.append(event)
+                    check_request()
+                    if event.is_final_response():
+                        final_event = event
 
-            return _RESPONSE_ERROR
+            if final_event is None:
+                return _RESPONSE_ERROR
+            try:
+                final_response: str = final_event.content.parts[0].text
+                return final_response
+            except Exception:
+                logger.exception(
+                    "Failed to extract final response user_id=%s session_id=%s request_id=%s",
+                    self.user_id,
+                    self.session.id,
+                    current_request_id(),
+                )
+                return _RESPONSE_ERROR
 
+        except (DeadlineExceededError, RequestCancelledError):
+            raise
         except Exception:
             logger.exception(
-                "Agent execution failed user_id=%s session_id=%s",
+                "Agent execution failed user_id=%s session_id=%s request_id=%s",
                 self.user_id,
                 self.session.id,
+                current_request_id(),
             )
             return _RESPONSE_ERROR
 
 
+def _estimate_tokens(event: Event) -> int:
+    """Rough token count of an event's content (about 4 characters per token)."""
+    if not event.content or not event.content.parts:
+        return 0
+    size = 0
+    for part in event.content.parts:
+        if part.text:
+            size += len(part.text)
+        elif part.function_call or part.function_response:
+            size += len(part.model_dump_json(exclude_none=True))
+    return size // 4
+
+
 class AgentClient:
     """Client for managing agent sessions and interactions."""
 
@@ -77,37 +156,291 @@ class AgentClient:
         session_service: VertexAiSessionService,
         app_name: str,
         agent: Agent,
+        compaction_max_events: Optional[int] = None,
+        compaction_token_budget: Optional[int] = None,
+        compaction_keep_events: int = 20,
+        summarizer: Optional[Callable[[list[Event]], Awaitable[str]]] = None,
+        spawn: Optional[Callable[[Coroutine], Optional[asyncio.Task]]] = None,
     ) -> None:
+        """
+        Args:
+            session_service: Session service storing sessions and events
+            app_name: Application name of the sessions
+            agent: Agent run for each response
+            compaction_max_events: Compact a session once it holds more events
+            compaction_token_budget: Compact a session once its events exceed
+                this estimated token count
+            compaction_keep_events: Recent events carried over on compaction
+            summarizer: Optional coroutine function turning the dropped events
+                into a summary that is kept in front of the recent events
+            spawn: Runs compaction in the background (defaults to
+                asyncio.create_task); may return None to refuse the work
+        """
         self.session_service: VertexAiSessionService = session_service
         self.app_name: str = app_name
         self.agent: Agent = agent
+        self.compaction_max_events: Optional[int] = compaction_max_events
+        self.compaction_token_budget: Optional[int] = compaction_token_budget
+        self.compaction_keep_events: int = compaction_keep_events
+        self.summarizer = summarizer
+        self._spawn = spawn or asyncio.create_task
+        # Compacted session id -> id of the session that replaced it
+        self._compacted: TTLCache[str, str] = TTLCache(
+            "compacted_session", max_entries=10000, ttl=24 * 60 * 60
+        )
+        self._compacting: set[str] = set()
+        self._background: set[asyncio.Task] = set()
+
+    @property
+    def compaction_enabled(self) -> bool:
+        return bool(self.compaction_max_events or self.compaction_token_budget)
+
+    def _new_agent_session(self, session: Session, user_id: str) -> AgentSession:
+        runner = Runner(
+            agent=self.agent,
+            app_name=self.app_name,
+            session_service=self.session_service,
+        )
+        on_response = self._schedule_compaction if self.compaction_enabled else None
+        return AgentSession(session, runner, user_id, on_response=on_response)
+
+    def _schedule_compaction(self, agent_session: AgentSession) -> None:
+        """Compact the session in the background if it is over budget"""
+        session = agent_session.session
+        if session.id in self._compacting or not self._needs_compaction(
+            session.events + agent_session.new_events
+        ):
+            return
+
+        task = self._spawn(self.compact_session(session.user_id, session.id))
+        if task is None:
+            return
+        self._compacting.add(session.id)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        task.add_done_callback(lambda _: self._compacting.discard(session.id))
+
+    def _needs_compaction(self, events: list[Event]) -> bool:
+        if self.compaction_max_events and len(events) > self.compaction_max_events:
+            return True
+        if self.compaction_token_budget:
+            return sum(map(_estimate_tokens, events)) > self.compaction_token_budget
+        return False
+
+    def _split_events(self, events: list[Event]) -> tuple[list[Event], list[Event]]:
+        """
+        Split events into dropped and kept, starting the kept part at a user
+        turn. The kept part is the last ``compaction_keep_events`` events,
+        trimmed to half the token budget if one is set.
+        """
+        # Keep at least the last event, even with compaction_keep_events=0
+        cut = max(0, min(len(events) - 1, len(events) - self.compaction_keep_events))
+        # Never separate a function call from its response
+        while cut > 0 and events[cut].author != "user":
+            cut -= 1
+
+        if self.compaction_token_budget:
+            # Drop whole turns until the kept part fills at most half the
+            # budget, so the next runs do not compact again right away; the
+            # last turn is always kept
+            target = self.compaction_token_budget // 2
+            tokens = sum(map(_estimate_tokens, events[cut:]))
+            while tokens > target:
+                next_turn = next(
+                    (i for i in range(cut + 1, len(events)) if events[i].author == "user"),
+                    None,
+                )
+                if next_turn is None:
+                    break
+                tokens -= sum(map(_estimate_tokens, events[cut:next_turn]))
+                cut = next_turn
+        return events[:cut], events[cut:]
+
+    async def compact_session(self, user_id: str, session_id: str) -> Optional[str]:
+        """
+        Replace a long session with a compacted copy.
+
+        The new session gets the session-scoped state (user: and app: values
+        are left alone and shared as before), an optional summary of the
+        dropped events and the most recent events. The old session is kept
+        and marked with the id of its replacement in its state, so later
+        lookups of the old id from any process resolve to the new session.
+        A new session that ends up unreferenced is deleted again.
+
+        Returns:
+            Id of the new session, or None if nothing was compacted
+        """
+        try:
+            with telemetry.span("session_compact"):
+                return await self._compact_session(user_id, session_id)
+        except Exception:
+            logger.exception(
+                "Failed to compact session user_id=%s session_id=%s",
+                user_id,
+                session_id,
+            )
+            return None
+
+    async def _compact_session(self, user_id: str, session_id: str) -> Optional[str]:
+        session = await self.session_service.get_session(
+            app_name=self.app_name, user_id=user_id, session_id=session_id
+        )
+        if session is None or not self._needs_compaction(session.events):
+            return None
+
+        dropped, kept = self._split_events(session.events)
+        if not dropped:
+            return None
+
+        compacted = await self.session_service.create_session(
+            app_name=self.app_name,
+            user_id=user_id,
+            state={
+                key: value
+                for key, value in session.state.items()
+                if not key.startswith(_UNCOPIED_STATE_PREFIXES)
+                and key != _COMPACTED_INTO_KEY
+            },
+        )
+
+        # Deleted again unless the old session ends up pointing at it, also
+        # when copying fails or is cancelled halfway
+        referenced = False
+        try:
+            if self.summarizer is not None:
+                summary = await self.summarizer(dropped)
+                await self.session_service.append_event(
+                    compacted,
+                    Event(
+                        invocation_id=dropped[-1].invocation_id,
+                        author=self.agent.name,
+                        content=types.Content(
+                            role="model",
+                            parts=[
+                                types.Part(
+                                    text="Summary of the earlier conversation: "
+                                    f"{summary}"
+                                )
+                            ],
+                        ),
+                        timestamp=dropped[-1].timestamp,
+                    ),
+                )
+
+            for event in kept:
+                # State changes were already applied and are carried by the
+                # session state, replaying them could overwrite newer values
+                await self.session_service.append_event(
+                    compacted,
+                    event.model_copy(
+                        update={
+                            "id": Event.new_id(),
+                            "actions": event.actions.model_copy(
+                                update={"state_delta": {}}
+                            ),
+                        }
+                    ),
+                )
+
+            # Give up if a run appended to the old session in the meantime
+            current = await self.session_service.get_session(
+                app_name=self.app_name, user_id=user_id, session_id=session_id
+            )
+            if current is None or len(current.events) != len(session.events):
+                return None
+
+            await self._mark_compacted(current, compacted.id)
+            referenced = True
+            # A run may have appended between the check and the marker; point
+            # the old session back at itself rather than lose its last turn
+            marked = await self.session_service.get_session(
+                app_name=self.app_name, user_id=user_id, session_id=session_id
+            )
+            if marked is None or len(marked.events) != len(current.events):
+                if marked is not None:
+                    await self._mark_compacted(marked, None)
+                referenced = False
+                return None
+        finally:
+            if not referenced:
+                await self._discard_compacted(user_id, compacted.id)
+
+        self._compacted.set(session_id, compacted.id)
+        telemetry.increment(_COMPACTED_EVENTS, len(dropped))
+        logger.info(
+            "Compacted session user_id=%s session_id=%s new_session_id=%s dropped=%d kept=%d",
+            user_id,
+            session_id,
+            compacted.id,
+            len(dropped),
+            len(kept),
+        )
+        return compacted.id
+
+    async def _mark_compacted(self, session: Session, replacement: Optional[str]) -> None:
+        """Record the replacement of a compacted session in its state"""
+        await self.session_service.append_event(
+            session,
+            Event(
+                invocation_id=Event.new_id(),
+                author=self.agent.name,
+                actions=EventActions(state_delta={_COMPACTED_INTO_KEY: replacement}),
+            ),
+        )
+
+    async def _discard_compacted(self, user_id: str, session_id: str) -> None:
+        try:
+            await self.session_service.delete_session(
+                app_name=self.app_name, user_id=user_id, session_id=session_id
+            )
+        except Exception:
+            logger.exception(
+                "Failed to delete unused compacted session user_id=%s session_id=%s",
+                user_id,
+                session_id,
+            )
+
+    def _resolve_session_id(self, session_id: str) -> str:
+        """Follow compaction replacements known to this process"""
+        while (replacement := self._compacted.get(session_id, record=False)) is not None:
+            session_id = replacement
+        return session_id
 
     async def create_session(
         self, user_id: str, state: Optional[dict] = None
     ) -> AgentSession:
         """Create a new session and return AgentSession instance."""
         try:
-            session = await self.session_service.create_session(
-                app_name=self.app_name, user_id=user_id, state=state
-            )
+            with telemetry.span("session_create"):
+                session = await self.session_service.create_session(
+                    app_name=self.app_name, user_id=user_id, state=state
+                )
         except Exception as exc:
             logger.exception("Failed to create session for user_id=%s", user_id)
             raise AgentClientError("Failed to create session") from exc
 
-        runner = Runner(
-            agent=self.agent,
-            app_name=self.app_name,
-            session_service=self.session_service,
-        )
-
-        return AgentSession(session, runner, user_id)
+        return self._new_agent_session(session, user_id)
 
     async def _get_session(self, user_id: str, session_id: str) -> AgentSession:
         """Get existing session and return AgentSession instance."""
+        requested_id = session_id
+        session_id = self._resolve_session_id(session_id)
         try:
-            session = await self.session_service.get_session(
-                app_name=self.app_name, user_id=user_id, session_id=session_id
-            )
+            with telemetry.span("session_get"):
+                for _ in range(_MAX_COMPACTION_HOPS):
+                    session = await self.session_service.get_session(
+                        app_name=self.app_name, user_id=user_id, session_id=session_id
+                    )
+                    replacement = (
+                        session.state.get(_COMPACTED_INTO_KEY) if session else None
+                    )
+                    if not replacement:
+                        break
+                    # Compacted by another process
+                    session_id = replacement
+                    self._compacted.set(requested_id, session_id)
+                else:
+                    session = None
         except Exception as exc:
             logger.exception(
                 "Failed to load existing session user_id=%s session_id=%s",
@@ -116,13 +449,15 @@ class AgentClient:
             )
             raise AgentClientError("Failed to load existing session") from exc
 
-        runner = Runner(
-            agent=self.agent,
-            app_name=self.app_name,
-            session_service=self.session_service,
-        )
+        if session is None:
+            # Missing, or still compacted after _MAX_COMPACTION_HOPS; never
+            # run on a session that has been replaced
+            logger.warning(
+                "Session not found user_id=%s session_id=%s", user_id, session_id
+            )
+            raise AgentClientError("Session not found")
 
-        return AgentSession(session, runner, user_id)
+        return self._new_agent_session(session, user_id)
 
     async def get_or_create_session(
         self, user_id: str, session_id: Optional[str] = None
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Bounded TTL cache with hit/miss metrics.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Generic, Hashable, Optional, TypeVar
+
+from util.telemetry.telemetry import telemetry
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """Thread-safe LRU cache whose entries expire after a per-entry TTL."""
+
+    def __init__(self, name: str, max_entries: int = 1024, ttl: float = 300.0):
+        """
+        Args:
+            name: Cache name used as the metrics label
+            max_entries: Maximum number of entries before LRU eviction
+            ttl: Default entry lifetime in seconds
+        """
+        self.name: str = name
+        self.max_entries: int = max_entries
+        self.ttl: float = ttl
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K, record: bool = True) -> Optional[V]:
+        """
+        Return the cached value, or None if missing or expired.
+
+        Args:
+            key: Cache key
+            record: Whether to count this lookup in the hit/miss metrics
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if record:
+            telemetry.record_cache(self.name, hit=entry is not None)
+        return entry[1] if entry is not None else None
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        """Store a value, overriding the default TTL if given."""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: K) -> Optional[V]:
+        """Remove and return a value."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[1] if entry is not None else None
@@ -11,6 +11,14 @@ from dotenv import load_dotenv
 from util.secret.secret import SecretManagerClient
 
 
+def _env_flag(name: str, default: bool = False) -> bool:
+    """Read a boolean flag from the environment."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
 class Config:
     """
     Configuration class for managing environment variables.
@@ -78,6 +86,37 @@ class Config:
         """
         return os.getenv("GCP_KMS_KEY_URI", "")
 
+    @property
+    def gcp_kms_previous_key_uris(self) -> list[str]:
+        """
+        Get retired GCP KMS Key URIs still accepted for decryption.
+
+        Returns:
+            List of GCP KMS Key URI strings (default: empty)
+        """
+        value = os.getenv("GCP_KMS_PREVIOUS_KEY_URIS", "")
+        return [uri.strip() for uri in value.split(",") if uri.strip()]
+
+    @property
+    def dek_cache_ttl(self) -> float:
+        """
+        Get seconds an unwrapped data encryption key is reused.
+
+        Returns:
+            TTL in seconds, 0 to disable (default: 0)
+        """
+        return float(os.getenv("DEK_CACHE_TTL", "0"))
+
+    @property
+    def compact_token_format(self) -> bool:
+        """
+        Get whether new encrypted tokens are written in the compact encoding.
+
+        Returns:
+            True if the compact encoding is written (default: False)
+        """
+        return _env_flag("COMPACT_TOKEN_FORMAT")
+
     @property
     def google_client_id(self) -> str:
         """
@@ -167,3 +206,167 @@ class Config:
             Port number as integer (default: 8000)
         """
         return int(os.getenv("PORT", "8000"))
+
+    @property
+    def telemetry_enabled(self) -> bool:
+        """
+        Get whether stage tracing and the /metrics endpoint are enabled.
+
+        Returns:
+            True if telemetry is enabled (default: False)
+        """
+        return _env_flag("TELEMETRY_ENABLED")
+
+    @property
+    def web_concurrency(self) -> int:
+        """
+        Get number of uvicorn worker processes.
+
+        Returns:
+            Worker count as integer (default: 1)
+        """
+        return max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+    @property
+    def graceful_shutdown_timeout(self) -> float:
+        """
+        Get seconds to wait for in-flight requests when shutting down.
+
+        Returns:
+            Timeout in seconds (default: 8)
+        """
+        return float(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", "8"))
+
+    @property
+    def shutdown_drain_timeout(self) -> float:
+        """
+        Get seconds to wait for background tasks after the server has
+        finished the open requests.
+
+        Returns:
+            Timeout in seconds (default: 2)
+        """
+        return float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "2"))
+
+    @property
+    def session_backend(self) -> str:
+        """
+        Get where session data is kept: "cookie" (signed cookie) or
+        "server" (in-memory store, the cookie only carries an opaque id).
+
+        Returns:
+            Session backend name (default: "cookie")
+        """
+        return os.getenv("SESSION_BACKEND", "cookie").strip().lower()
+
+    @property
+    def session_store_max_entries(self) -> int:
+        """
+        Get the maximum number of sessions kept by the server-side store.
+
+        Returns:
+            Maximum entry count (default: 10000)
+        """
+        return int(os.getenv("SESSION_STORE_MAX_ENTRIES", "10000"))
+
+    @property
+    def session_max_age(self) -> int:
+        """
+        Get session lifetime in seconds.
+
+        Returns:
+            Session lifetime in seconds (default: 14 days)
+        """
+        return int(os.getenv("SESSION_MAX_AGE", str(14 * 24 * 60 * 60)))
+
+    @property
+    def credential_prewarm(self) -> bool:
+        """
+        Get whether user credentials are warmed after login and on /llm.
+
+        Returns:
+            True if pre-warming is enabled (default: False)
+        """
+        return _env_flag("CREDENTIAL_PREWARM")
+
+    @property
+    def userinfo_cache_ttl(self) -> float:
+        """
+        Get seconds a userinfo response is reused when credential
+        pre-warming is enabled.
+
+        Returns:
+            TTL in seconds (default: 300)
+        """
+        return float(os.getenv("USERINFO_CACHE_TTL", "300"))
+
+    @property
+    def session_compaction_max_events(self) -> int:
+        """
+        Get the number of events after which a session is compacted.
+
+        Returns:
+            Event count, 0 to disable (default: 0)
+        """
+        return int(os.getenv("SESSION_COMPACTION_MAX_EVENTS", "0"))
+
+    @property
+    def session_compaction_token_budget(self) -> int:
+        """
+        Get the estimated token count after which a session is compacted.
+
+        Returns:
+            Token count, 0 to disable (default: 0)
+        """
+        return int(os.getenv("SESSION_COMPACTION_TOKEN_BUDGET", "0"))
+
+    @property
+    def session_compaction_keep_events(self) -> int:
+        """
+        Get the number of recent events kept when a session is compacted.
+
+        Returns:
+            Event count (default: 20)
+        """
+        return int(os.getenv("SESSION_COMPACTION_KEEP_EVENTS", "20"))
+
+    @property
+    def profiler_enabled(self) -> bool:
+        """
+        Get whether the admin profiling endpoint is registered.
+
+        Returns:
+            True if the profiler is enabled (default: False)
+        """
+        return _env_flag("PROFILER_ENABLED")
+
+    @property
+    def admin_emails(self) -> set[str]:
+        """
+        Get IAP user emails allowed to use admin endpoints.
+
+        Returns:
+            Set of email addresses (default: empty)
+        """
+        value = os.getenv("ADMIN_EMAILS", "")
+        return {email.strip().lower() for email in value.split(",") if email.strip()}
+
+    @property
+    def request_timeout(self) -> float:
+        """
+        Get seconds an /llm request may take before its work is cancelled.
+
+        Returns:
+            Timeout in seconds, 0 for no deadline (default: 0)
+        """
+        return float(os.getenv("REQUEST_TIMEOUT", "0"))
+
+    @property
+    def tool_concurrency(self) -> int:
+        """
+        Get how many tool calls of one agent turn may run at once.
+
+        Returns:
+            Concurrent tool calls, 1 for sequential, 0 for no limit (default: 4)
+        """
+        return int(os.getenv("TOOL_CONCURRENCY", "4"))
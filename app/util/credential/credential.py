@@ -3,27 +3,161 @@
 Credential management with encrypted refresh tokens
 """
 
+import asyncio
+import contextvars
 import logging
-from typing import Optional
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
 
+from authlib.common.errors import AuthlibBaseError
 from authlib.integrations.requests_client import OAuth2Session
 from google.adk.tools import ToolContext
+from google.api_core import exceptions as api_exceptions
+from google.auth import exceptions as auth_exceptions
+from util.cache.cache import TTLCache
+from util.deadline.deadline import (
+    DeadlineExceededError,
+    RequestCancelledError,
+    check_request,
+)
 from util.envelope.envelope_aead import EnvelopeAEAD
+from util.resilience.resilience import Dependency
+from util.telemetry.telemetry import telemetry
 
 logger = logging.getLogger(__name__)
 
+# Access tokens are dropped from the cache this many seconds before they expire
+ACCESS_TOKEN_EXPIRY_SKEW = 60
+
+# Invocation memos created outside an invocation scope and not wiped by the
+# after-agent callback are dropped after this
+INVOCATION_MEMO_MAX_AGE = 600
+
+PREWARM_COUNTER = "adk_credential_prewarm_total"
+
+telemetry.describe(PREWARM_COUNTER, "Credential pre-warm attempts by result.")
+
+
+def _is_transient_refresh_error(exc: BaseException) -> bool:
+    """OAuth errors such as invalid_grant are final; anything else may be transient."""
+    return not isinstance(exc, AuthlibBaseError)
+
+
+# KMS being unreachable or overloaded; a wrong AAD or a corrupt token fails
+# the same way on every attempt and says nothing about the dependency
+_TRANSIENT_KMS_ERRORS = (
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.InternalServerError,
+    api_exceptions.GatewayTimeout,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.TooManyRequests,
+    api_exceptions.Aborted,
+    api_exceptions.RetryError,
+    auth_exceptions.TransportError,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+def _is_transient_kms_error(exc: BaseException) -> bool:
+    """Walk the TinkError chain for a transport or KMS availability error."""
+    seen: set[int] = set()
+    current: Optional[BaseException] = exc
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        if isinstance(current, _TRANSIENT_KMS_ERRORS):
+            return True
+        cause = current.__cause__ or current.__context__
+        if cause is None and current.args and isinstance(current.args[0], BaseException):
+            cause = current.args[0]
+        current = cause
+    return False
+
+
+class _InvocationMemo:
+    """Credentials resolved during one agent invocation, keyed by encrypted token."""
+
+    __slots__ = ("invocation", "created_at", "lock", "refresh_tokens", "access_tokens")
+
+    def __init__(self, invocation: Any) -> None:
+        # Holding the invocation keeps its id() from being reused while memoized
+        self.invocation = invocation
+        self.created_at: float = time.monotonic()
+        self.lock: asyncio.Lock = asyncio.Lock()
+        self.refresh_tokens: dict[str, str] = {}
+        self.access_tokens: dict[str, str] = {}
+
+    def wipe(self) -> None:
+        self.refresh_tokens.clear()
+        self.access_tokens.clear()
+        self.invocation = None
+
+
+# Memos created under the current Credential.invocation_scope()
+_scoped_memos: contextvars.ContextVar[Optional[list[_InvocationMemo]]] = (
+    contextvars.ContextVar("scoped_memos", default=None)
+)
+
 
 class Credential:
     """
     Class for managing encrypted refresh tokens
     """
 
-    def __init__(self, envelope_aead: EnvelopeAEAD, oauth_session=OAuth2Session):
+    def __init__(
+        self,
+        envelope_aead: EnvelopeAEAD,
+        oauth_session=OAuth2Session,
+        access_token_cache_size: int = 0,
+        kms_dependency: Optional[Dependency] = None,
+        token_dependency: Optional[Dependency] = None,
+    ):
         """
         Initialize with EnvelopeAEAD and OAuth2Session
+
+        KMS unwraps and token refreshes run through the given resilience
+        policies (hedging, circuit breaking, retries) on their threads;
+        defaults are used if not given. Their timeouts match the KMS and
+        OAuth2 client timeouts so abandoned attempts free their thread.
+
+        Access tokens are only kept across requests when
+        ``access_token_cache_size`` is set, which pre-warming needs;
+        otherwise they live in the invocation memo of the turn.
         """
         self.envelope_aead = envelope_aead
         self.oauth_session = oauth_session
+        self.kms_dependency: Dependency = kms_dependency or Dependency(
+            "kms", timeout=2.0, retryable=_is_transient_kms_error, max_workers=4
+        )
+        self.token_dependency: Dependency = token_dependency or Dependency(
+            "token_endpoint",
+            timeout=3.0,
+            retryable=_is_transient_refresh_error,
+            max_workers=4,
+        )
+        self._access_tokens: Optional[TTLCache[tuple[str, str], str]] = (
+            TTLCache("access_token", max_entries=access_token_cache_size)
+            if access_token_cache_size > 0
+            else None
+        )
+        self._pending: dict[tuple[str, str], asyncio.Future] = {}
+        self._invocations: dict[int, _InvocationMemo] = {}
+
+    def warm_up(self) -> None:
+        """
+        Establish the KMS client channel before the first token is handled
+        """
+        self.envelope_aead.warm_up()
+
+    def close(self) -> None:
+        """
+        Close the pooled connections of the OAuth2 session and stop the
+        KMS and token endpoint threads
+        """
+        self.oauth_session.close()
+        self.kms_dependency.close()
+        self.token_dependency.close()
 
     def encrypt_token(self, token: str, user_id: str) -> str:
         """
@@ -65,32 +199,207 @@ class Credential:
             )
             return None
 
-    def _get_access_token_from_refresh_token(self, refresh_token: str) -> Optional[str]:
+    def _refresh_access_token(self, refresh_token: str) -> dict:
         """
-        Get access token from refresh token
+        Get a new token response from refresh token
 
         Args:
             refresh_token: Refresh token
 
         Returns:
-            Access token, or None if failed to refresh
+            Token response containing the access token
         """
-        try:
-            token = self.oauth_session.refresh_token(
+        with telemetry.span("token_refresh"):
+            return self.oauth_session.refresh_token(
                 refresh_token=refresh_token,
             )
 
-            return token.get("access_token")
+    async def _fetch_access_token(
+        self,
+        user_id: str,
+        encrypted_token: str,
+        memo: Optional[_InvocationMemo] = None,
+    ) -> Optional[str]:
+        """
+        Decrypt the refresh token, exchange it and cache the access token
+
+        Args:
+            user_id: User's email address
+            encrypted_token: Encrypted refresh token from session state
+            memo: Invocation memo holding an already decrypted refresh token
+
+        Returns:
+            Access token, or None if failed to retrieve
+
+        Raises:
+            DeadlineExceededError: The request deadline passed
+            RequestCancelledError: The request was cancelled
+        """
+        refresh_token = memo.refresh_tokens.get(encrypted_token) if memo else None
+        if refresh_token is None:
+            try:
+                refresh_token = await self.kms_dependency.call_blocking(
+                    lambda: self.envelope_aead.decrypt_token(encrypted_token, user_id)
+                )
+            except (DeadlineExceededError, RequestCancelledError):
+                raise
+            except Exception:
+                logger.exception("Failed to decrypt token user_id=%s", user_id)
+                return None
+            if memo is not None:
+                memo.refresh_tokens[encrypted_token] = refresh_token
+
+        try:
+            token = await self.token_dependency.call_blocking(
+                lambda: self._refresh_access_token(refresh_token)
+            )
+        except (DeadlineExceededError, RequestCancelledError):
+            raise
         except Exception:
             logger.exception("Error refreshing token")
             return None
 
-    def get_access_token_from_context(
+        access_token = token.get("access_token")
+        if not access_token:
+            return None
+
+        ttl = float(token.get("expires_in") or 0) - ACCESS_TOKEN_EXPIRY_SKEW
+        if self._access_tokens is not None and ttl > 0:
+            self._access_tokens.set((user_id, encrypted_token), access_token, ttl)
+        return access_token
+
+    async def get_access_token(
+        self,
+        user_id: str,
+        encrypted_token: str,
+        record: bool = True,
+        memo: Optional[_InvocationMemo] = None,
+    ) -> Optional[str]:
+        """
+        Get access token for an encrypted refresh token
+
+        Served from the access token cache while valid, if enabled; a cached
+        token is returned without checking that the refresh token still
+        works. Concurrent callers for the same
+        token share one decrypt and refresh, which run off the event loop
+        under the KMS and token endpoint resilience policies and within the
+        deadline of the request that started them.
+
+        Args:
+            user_id: User's email address
+            encrypted_token: Encrypted refresh token from session state
+            record: Whether to count the cache lookup in the hit/miss metrics
+            memo: Invocation memo to reuse and store the decrypted refresh token
+
+        Returns:
+            Access token, or None if failed to retrieve
+        """
+        key = (user_id, encrypted_token)
+        if self._access_tokens is not None:
+            access_token = self._access_tokens.get(key, record=record)
+            if access_token:
+                return access_token
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(
+                self._fetch_access_token(user_id, encrypted_token, memo)
+            )
+            self._pending[key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+
+        try:
+            return await asyncio.shield(pending)
+        except (DeadlineExceededError, RequestCancelledError):
+            # The shared fetch belonged to another request that gave up
+            check_request()
+            return await self.get_access_token(user_id, encrypted_token, False, memo)
+
+    async def prewarm(self, user_id: str, encrypted_token: str) -> None:
+        """
+        Fill the access token cache ahead of the first tool call
+
+        Does nothing unless the access token cache is enabled.
+
+        Args:
+            user_id: User's email address
+            encrypted_token: Encrypted refresh token from session state
+        """
+        if self._access_tokens is None:
+            return
+        if self._access_tokens.get((user_id, encrypted_token), record=False):
+            telemetry.increment(PREWARM_COUNTER, result="already_warm")
+            return
+
+        access_token = await self.get_access_token(user_id, encrypted_token, record=False)
+        telemetry.increment(PREWARM_COUNTER, result="ok" if access_token else "failed")
+
+    def _invocation_memo(self, invocation: Any) -> _InvocationMemo:
+        """Get or create the memo of an invocation context"""
+        memo = self._invocations.get(id(invocation))
+        if memo is not None and memo.invocation is invocation:
+            return memo
+
+        now = time.monotonic()
+        for key, stale in list(self._invocations.items()):
+            if now - stale.created_at > INVOCATION_MEMO_MAX_AGE:
+                stale.wipe()
+                del self._invocations[key]
+
+        memo = self._invocations[id(invocation)] = _InvocationMemo(invocation)
+        scoped = _scoped_memos.get()
+        if scoped is not None:
+            scoped.append(memo)
+        return memo
+
+    @contextmanager
+    def invocation_scope(self) -> Iterator[None]:
+        """
+        Wipe credentials memoized by agent runs inside the block on exit
+
+        The after-agent callback is skipped when a tool or the model raises
+        or the run is cancelled, so the agent run should be wrapped in this
+        to make sure plaintext tokens do not outlive the request.
+        """
+        memos: list[_InvocationMemo] = []
+        token = _scoped_memos.set(memos)
+        try:
+            yield
+        finally:
+            _scoped_memos.reset(token)
+            for memo in memos:
+                key = id(memo.invocation)
+                if self._invocations.get(key) is memo:
+                    del self._invocations[key]
+                memo.wipe()
+
+    def clear_invocation(self, callback_context: Any) -> None:
+        """
+        Wipe credentials memoized for an invocation
+
+        Meant to be registered as the root agent's after_agent_callback so
+        plaintext tokens do not outlive the turn; invocation_scope() covers
+        runs that end before the callback.
+
+        Args:
+            callback_context: ADK callback context of the finished invocation
+        """
+        memo = self._invocations.pop(id(callback_context._invocation_context), None)
+        if memo is not None:
+            memo.wipe()
+        return None
+
+    async def get_access_token_from_context(
         self, tool_context: ToolContext, state_key: str
     ) -> Optional[str]:
         """
         Get access token using the refresh token stored in ToolContext
 
+        The decrypted refresh token and access token are memoized on the
+        invocation, so only the first tool call of a turn does credential
+        work; concurrent calls wait for it. Deadline and cancellation errors
+        of the current request are raised rather than mapped to None.
+
         Args:
             tool_context: Tool context containing encrypted token
             state_key: Key in the state dictionary where the encrypted token is stored
@@ -98,10 +407,24 @@ class Credential:
         Returns:
             Access token, or None if failed to retrieve
         """
-        refresh_token = self.get_decrypted_token_from_context(
-            tool_context=tool_context, state_key=state_key
-        )
-        if not refresh_token:
+        if state_key not in tool_context.state:
             return None
 
-        return self._get_access_token_from_refresh_token(refresh_token)
+        invocation = tool_context._invocation_context
+        encrypted_token = tool_context.state[state_key]
+        memo = self._invocation_memo(invocation)
+
+        async with memo.lock:
+            access_token = memo.access_tokens.get(encrypted_token)
+            telemetry.record_cache("invocation_credential", hit=access_token is not None)
+            if access_token is not None:
+                return access_token
+
+            access_token = await self.get_access_token(
+                user_id=invocation.user_id,
+                encrypted_token=encrypted_token,
+                memo=memo,
+            )
+            if access_token:
+                memo.access_tokens[encrypted_token] = access_token
+            return access_token
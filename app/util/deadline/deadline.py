@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Per-request deadline and cancellation context.
+
+The context is set by the route and carried in a context variable, so the
+agent run, credential handling, tools and outbound calls made on behalf of
+the request all see it without it being passed around.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import time
+from typing import Awaitable, Callable, Coroutine, Optional, TypeVar
+
+from starlette.types import Receive
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a call cannot finish before its deadline."""
+
+    pass
+
+
+class RequestCancelledError(Exception):
+    """Raised when the client of the request has gone away."""
+
+    pass
+
+
+class RequestContext:
+    """Deadline and cancellation state of one request."""
+
+    def __init__(self, timeout: Optional[float] = None) -> None:
+        """
+        Args:
+            timeout: Seconds the request may take, or None for no deadline
+        """
+        self.deadline: Optional[float] = (
+            time.monotonic() + timeout if timeout else None
+        )
+        self.cancelled: bool = False
+
+    def remaining(self) -> Optional[float]:
+        """Return seconds left before the deadline, or None without one."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+    def check(self) -> None:
+        """
+        Raises:
+            RequestCancelledError: The request was cancelled
+            DeadlineExceededError: The deadline has passed
+        """
+        if self.cancelled:
+            raise RequestCancelledError("Request was cancelled")
+        if self.expired:
+            raise DeadlineExceededError("Request deadline exceeded")
+
+
+_request_context: contextvars.ContextVar[Optional[RequestContext]] = (
+    contextvars.ContextVar("request_context", default=None)
+)
+
+
+def current_request_context() -> Optional[RequestContext]:
+    """Return the context of the request being handled, if any."""
+    return _request_context.get()
+
+
+def check_request() -> None:
+    """Raise if the current request was cancelled or is past its deadline."""
+    context = _request_context.get()
+    if context is not None:
+        context.check()
+
+
+async def wait_for_disconnect(receive: Receive) -> None:
+    """Wait until the ASGI server reports that the client disconnected."""
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def run_request(
+    coro: Coroutine[None, None, T],
+    context: RequestContext,
+    disconnected: Optional[Callable[[], Awaitable[None]]] = None,
+) -> T:
+    """
+    Run ``coro`` under ``context`` and cancel it when the deadline passes
+    or the client disconnects.
+
+    Args:
+        coro: Work done on behalf of the request
+        context: Deadline and cancellation state made current for the work
+        disconnected: Coroutine function returning once the client is gone
+
+    Raises:
+        DeadlineExceededError: The deadline passed first
+        RequestCancelledError: The client disconnected first
+    """
+    token = _request_context.set(context)
+    try:
+        work = asyncio.ensure_future(coro)
+    finally:
+        _request_context.reset(token)
+
+    tasks: set[asyncio.Future] = {work}
+    watcher: Optional[asyncio.Future] = None
+    if disconnected is not None:
+        watcher = asyncio.ensure_future(disconnected())
+        tasks.add(watcher)
+
+    try:
+        done, _ = await asyncio.wait(
+            tasks, timeout=context.remaining(), return_when=asyncio.FIRST_COMPLETED
+        )
+        if work in done:
+            return work.result()
+
+        if watcher is not None and watcher in done:
+            logger.info("Client disconnected, cancelling request work")
+            raise RequestCancelledError("Client disconnected")
+        logger.warning("Request deadline exceeded, cancelling request work")
+        raise DeadlineExceededError("Request deadline exceeded")
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        if not work.done():
+            context.cancel()
+            work.cancel()
+            await asyncio.gather(work, return_exceptions=True)
@@ -1,41 +1,177 @@
 #!/usr/bin/env python3
 """
 Tink Envelope AEAD implementation for encrypting and decrypting data using GCP KMS.
+
+Encrypted tokens are stored in a compact, versioned encoding:
+
+    URL-safe Base64 without padding of
+    version (1 byte) | KEK hint (2 bytes) | DEK length (2 bytes, big endian)
+    | encrypted DEK | AEAD payload
+
+The KEK hint is the first two bytes of SHA-256 over the KEK URI, so the
+right KEK is picked without trial decryption. Values written before the
+compact encoding (standard Base64 of Tink's envelope, whose 4-byte length
+prefix always encodes to a leading "AA") are still accepted.
+
+New values keep the legacy encoding unless ``write_compact`` is set, so a
+release that can read the compact encoding is rolled out everywhere before
+anything writes it; a revision without the decoder, e.g. after a rollback
+or during a traffic split, cannot read compact values.
 """
 
 from __future__ import annotations
 
 import base64
+import hashlib
 import logging
-from typing import Optional
+import struct
+from typing import Optional, Sequence
 
 import tink
-from tink import aead
-from tink.integration import gcpkms
+from google.api_core import exceptions as core_exceptions
+from google.cloud import kms_v1
+from google.oauth2 import service_account
+from tink import aead, core
+from tink.proto import tink_pb2
+from util.cache.cache import TTLCache
+from util.telemetry.telemetry import telemetry
 
 logger = logging.getLogger(__name__)
 
+TOKEN_FORMAT_VERSION = 1
+
+_GCP_KEYURI_PREFIX = "gcp-kms://"
+_LEGACY_PREFIX = "AA"
+_HEADER = struct.Struct(">B2sH")
+_LEGACY_DEK_LEN = struct.Struct(">I")
+_MAX_ENCRYPTED_DEK_LEN = 4096
+
+
+def _kek_hint(kek_uri: str) -> bytes:
+    return hashlib.sha256(kek_uri.encode("utf-8")).digest()[:2]
+
+
+class _KmsAead(aead.Aead):
+    """
+    KMS-backed AEAD whose calls give up after ``timeout``.
+
+    Tink's GCP KMS AEAD calls KMS without a deadline and with the client's
+    default retries, which can hold a worker thread long after the caller
+    has timed out. Retries are left to the caller's resilience policy.
+    """
+
+    def __init__(
+        self, client: kms_v1.KeyManagementServiceClient, key_name: str, timeout: float
+    ):
+        self.client = client
+        self.name = key_name
+        self.timeout = timeout
+
+    def encrypt(self, plaintext: bytes, associated_data: bytes) -> bytes:
+        try:
+            response = self.client.encrypt(
+                request=kms_v1.EncryptRequest(
+                    name=self.name,
+                    plaintext=plaintext,
+                    additional_authenticated_data=associated_data,
+                ),
+                timeout=self.timeout,
+                retry=None,
+            )
+        except core_exceptions.GoogleAPIError as exc:
+            raise tink.TinkError(exc) from exc
+        return response.ciphertext
+
+    def decrypt(self, ciphertext: bytes, associated_data: bytes) -> bytes:
+        try:
+            response = self.client.decrypt(
+                request=kms_v1.DecryptRequest(
+                    name=self.name,
+                    ciphertext=ciphertext,
+                    additional_authenticated_data=associated_data,
+                ),
+                timeout=self.timeout,
+                retry=None,
+            )
+        except core_exceptions.GoogleAPIError as exc:
+            raise tink.TinkError(exc) from exc
+        return response.plaintext
+
 
 class EnvelopeAEAD:
     """Envelope AEAD helper backed by a GCP KMS-held KEK."""
 
-    def __init__(self, kek_uri: str, credentials_path: Optional[str] = None):
-        """Initialize EnvelopeAEAD with GCP KMS KEK URI."""
+    def __init__(
+        self,
+        kek_uri: str,
+        credentials_path: Optional[str] = None,
+        previous_kek_uris: Sequence[str] = (),
+        dek_cache_ttl: float = 0.0,
+        kms_timeout: float = 2.0,
+        write_compact: bool = False,
+    ):
+        """
+        Initialize EnvelopeAEAD with GCP KMS KEK URI.
+
+        Args:
+            kek_uri: KEK used for new values
+            credentials_path: Optional service account credentials file
+            previous_kek_uris: Retired KEKs still accepted for decryption
+            dek_cache_ttl: Seconds an unwrapped DEK is reused for values
+                sharing it (0 disables the cache and unwraps every time)
+            kms_timeout: Seconds a single KMS call may take
+            write_compact: Write new values in the compact encoding instead
+                of the legacy one (both are always read)
+        """
+        self.kms_timeout: float = kms_timeout
+        self.write_compact: bool = write_compact
+        self.dek_template = aead.aead_key_templates.AES256_GCM
         try:
             aead.register()
-            self.client = gcpkms.GcpKmsClient(kek_uri, credentials_path)
-            self.remote_aead = self.client.get_aead(kek_uri)
+            self.remote_aead = self._get_remote_aead(kek_uri, credentials_path)
             self.envelope_aead = aead.KmsEnvelopeAead(
-                aead.aead_key_templates.AES256_GCM, self.remote_aead
+                self.dek_template, self.remote_aead
             )
+            self.kek_hint: bytes = _kek_hint(kek_uri)
+            self._remote_aeads: dict[bytes, list[aead.Aead]] = {
+                self.kek_hint: [self.remote_aead]
+            }
+            self._legacy_envelope_aeads: list[aead.Aead] = [self.envelope_aead]
+            for uri in previous_kek_uris:
+                remote_aead = self._get_remote_aead(uri, credentials_path)
+                self._remote_aeads.setdefault(_kek_hint(uri), []).append(remote_aead)
+                self._legacy_envelope_aeads.append(
+                    aead.KmsEnvelopeAead(self.dek_template, remote_aead)
+                )
         except Exception as exc:
             logger.exception("Failed to initialize EnvelopeAEAD kek_uri=%s", kek_uri)
             raise tink.TinkError("Failed to initialize EnvelopeAEAD") from exc
 
+        self._deks: Optional[TTLCache[bytes, aead.Aead]] = (
+            TTLCache("dek", ttl=dek_cache_ttl) if dek_cache_ttl > 0 else None
+        )
+
+    def _get_remote_aead(
+        self, kek_uri: str, credentials_path: Optional[str]
+    ) -> aead.Aead:
+        """Get the KMS-backed AEAD for a KEK URI."""
+        if not kek_uri.startswith(_GCP_KEYURI_PREFIX):
+            raise tink.TinkError(f"Invalid KEK URI {kek_uri}")
+        credentials = (
+            service_account.Credentials.from_service_account_file(credentials_path)
+            if credentials_path
+            else None
+        )
+        client = kms_v1.KeyManagementServiceClient(credentials=credentials)
+        return _KmsAead(
+            client, kek_uri[len(_GCP_KEYURI_PREFIX) :], self.kms_timeout
+        )
+
     def _encrypt(self, plaintext: bytes, additional_data: bytes = b"") -> bytes:
         """Encrypt plaintext with optional additional authenticated data (AAD)."""
         try:
-            return self.envelope_aead.encrypt(plaintext, additional_data)
+            with telemetry.span("kms_encrypt"):
+                return self.envelope_aead.encrypt(plaintext, additional_data)
         except Exception as exc:
             logger.exception("Envelope encryption failed")
             raise tink.TinkError("Failed to encrypt data") from exc
@@ -43,28 +179,111 @@ class EnvelopeAEAD:
     def _decrypt(self, ciphertext: bytes, additional_data: bytes = b"") -> bytes:
         """Decrypt ciphertext with optional additional authenticated data (AAD)."""
         try:
-            return self.envelope_aead.decrypt(ciphertext, additional_data)
+            with telemetry.span("kms_decrypt"):
+                return self.envelope_aead.decrypt(ciphertext, additional_data)
         except Exception as exc:
             logger.exception("Envelope decryption failed")
             raise tink.TinkError("Failed to decrypt data") from exc
 
+    def _decrypt_legacy(self, ciphertext: bytes, additional_data: bytes) -> bytes:
+        """Decrypt a Tink envelope without KEK hint, trying each known KEK."""
+        for envelope_aead in self._legacy_envelope_aeads[1:]:
+            try:
+                return envelope_aead.decrypt(ciphertext, additional_data)
+            except tink.TinkError:
+                continue
+        raise tink.TinkError("No KEK could decrypt the legacy token")
+
+    def _get_dek_aead(self, remote_aead: aead.Aead, encrypted_dek: bytes) -> aead.Aead:
+        """Unwrap a DEK with KMS, or reuse it from the DEK cache."""
+        if self._deks is not None:
+            dek_aead = self._deks.get(encrypted_dek)
+            if dek_aead is not None:
+                return dek_aead
+
+        with telemetry.span("kms_decrypt"):
+            dek_bytes = remote_aead.decrypt(encrypted_dek, b"")
+        dek_aead = core.Registry.primitive(
+            tink_pb2.KeyData(
+                type_url=self.dek_template.type_url,
+                value=dek_bytes,
+                key_material_type=tink_pb2.KeyData.SYMMETRIC,
+            ),
+            aead.Aead,
+        )
+        if self._deks is not None:
+            self._deks.set(encrypted_dek, dek_aead)
+        return dek_aead
+
+    def _decrypt_compact(self, data: bytes, additional_data: bytes) -> bytes:
+        """Decrypt a value in the compact encoding."""
+        if len(data) < _HEADER.size:
+            raise tink.TinkError("Token is too short")
+
+        version, hint, dek_len = _HEADER.unpack_from(data)
+        if version != TOKEN_FORMAT_VERSION:
+            raise tink.TinkError(f"Unsupported token format version {version}")
+        if dek_len > min(_MAX_ENCRYPTED_DEK_LEN, len(data) - _HEADER.size):
+            raise tink.TinkError("Invalid encrypted DEK length")
+
+        remote_aeads = self._remote_aeads.get(hint)
+        if not remote_aeads:
+            raise tink.TinkError("Token was encrypted with an unknown KEK")
+
+        encrypted_dek = data[_HEADER.size : _HEADER.size + dek_len]
+        payload = data[_HEADER.size + dek_len :]
+        for remote_aead in remote_aeads[:-1]:
+            # Only reached on a 16-bit hint collision between configured KEKs
+            try:
+                dek_aead = self._get_dek_aead(remote_aead, encrypted_dek)
+                return dek_aead.decrypt(payload, additional_data)
+            except tink.TinkError:
+                continue
+        dek_aead = self._get_dek_aead(remote_aeads[-1], encrypted_dek)
+        return dek_aead.decrypt(payload, additional_data)
+
+    def encode_envelope(self, ciphertext: bytes) -> str:
+        """Convert a Tink envelope ciphertext to the compact encoding."""
+        (dek_len,) = _LEGACY_DEK_LEN.unpack_from(ciphertext)
+        body = ciphertext[_LEGACY_DEK_LEN.size :]
+        header = _HEADER.pack(TOKEN_FORMAT_VERSION, self.kek_hint, dek_len)
+        return base64.urlsafe_b64encode(header + body).rstrip(b"=").decode("ascii")
+
     def encrypt_token(self, token: str, additional_data: str = "") -> str:
-        """Encrypt token data and return Base64 encoded string."""
+        """Encrypt token data and return it in the compact or legacy encoding."""
         try:
             ciphertext = self._encrypt(
                 token.encode("utf-8"), additional_data.encode("utf-8")
             )
+            if self.write_compact:
+                return self.encode_envelope(ciphertext)
             return base64.b64encode(ciphertext).decode("utf-8")
         except Exception as exc:
             logger.exception("Failed to encrypt token")
             raise tink.TinkError("Failed to encrypt token") from exc
 
-    def decrypt_token(self, base64_ciphertext: str, additional_data: str = "") -> str:
-        """Decrypt token data from Base64 encoded string."""
+    def decrypt_token(self, encoded_ciphertext: str, additional_data: str = "") -> str:
+        """Decrypt token data from the compact or legacy Base64 encoding."""
         try:
-            ciphertext = base64.b64decode(base64_ciphertext.encode("utf-8"))
-            plaintext = self._decrypt(ciphertext, additional_data.encode("utf-8"))
+            aad = additional_data.encode("utf-8")
+            if encoded_ciphertext.startswith(_LEGACY_PREFIX):
+                ciphertext = base64.b64decode(encoded_ciphertext.encode("utf-8"))
+                try:
+                    plaintext = self._decrypt(ciphertext, aad)
+                except tink.TinkError:
+                    if len(self._legacy_envelope_aeads) == 1:
+                        raise
+                    plaintext = self._decrypt_legacy(ciphertext, aad)
+            else:
+                padding = "=" * (-len(encoded_ciphertext) % 4)
+                data = base64.urlsafe_b64decode(encoded_ciphertext + padding)
+                plaintext = self._decrypt_compact(data, aad)
             return plaintext.decode("utf-8")
         except Exception as exc:
             logger.exception("Failed to decrypt token")
             raise tink.TinkError("Failed to decrypt token") from exc
+
+    def warm_up(self) -> None:
+        """Round-trip a probe through KMS to establish the client channel."""
+        probe = b"warm-up"
+        self._decrypt(self._encrypt(probe, probe), probe)
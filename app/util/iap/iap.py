@@ -6,6 +6,9 @@ import logging
 import jwt
 from jwt import InvalidTokenError, PyJWKClient
 from starlette.requests import Request
+from util.telemetry.telemetry import telemetry
+
+IAP_JWKS_URL = "https://www.gstatic.com/iap/verify/public_key-jwk"
 
 
 class IAPVerificationError(Exception):
@@ -17,6 +20,24 @@ class IAPVerificationError(Exception):
 logger = logging.getLogger(__name__)
 
 
+class _InstrumentedJWKClient(PyJWKClient):
+    """PyJWKClient that counts and times JWKS fetches (i.e. cache misses)."""
+
+    def __init__(self, uri: str) -> None:
+        super().__init__(uri, cache_jwk_set=True, lifespan=300)
+        self.fetch_count = 0
+
+    def fetch_data(self):
+        self.fetch_count += 1
+        with telemetry.span("iap_jwks_fetch"):
+            return super().fetch_data()
+
+
+# Shared across requests so the JWKS is fetched once per cache lifespan
+# instead of on every verification.
+_jwk_client = _InstrumentedJWKClient(IAP_JWKS_URL)
+
+
 def verify_iap_jwt_from_request(
     request: Request, *, audience: str, issuer: str = "https://cloud.google.com/iap"
 ) -> str:
@@ -42,16 +63,18 @@ def verify_iap_jwt_from_request(
         )
 
     try:
-        jwk_client = PyJWKClient("https://www.gstatic.com/iap/verify/public_key-jwk")
-        signing_key = jwk_client.get_signing_key_from_jwt(assertion)
-
-        claim = jwt.decode(
-            assertion,
-            signing_key.key,
-            algorithms=["ES256"],
-            audience=audience,
-            issuer=issuer,
-        )
+        with telemetry.span("iap_verify"):
+            fetch_count = _jwk_client.fetch_count
+            signing_key = _jwk_client.get_signing_key_from_jwt(assertion)
+            telemetry.record_cache("jwks", hit=_jwk_client.fetch_count == fetch_count)
+
+            claim = jwt.decode(
+                assertion,
+                signing_key.key,
+                algorithms=["ES256"],
+                audience=audience,
+                issuer=issuer,
+            )
 
         email = claim.get("email")
         if not email:
@@ -64,3 +87,8 @@ def verify_iap_jwt_from_request(
     except Exception as exc:
         logger.exception("Unexpected error during IAP verification")
         raise IAPVerificationError("Unexpected error during IAP verification") from exc
+
+
+def warm_up_jwks() -> None:
+    """Populate the shared IAP JWKS cache ahead of the first request."""
+    _jwk_client.get_jwk_set()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+In-flight work tracking and draining for graceful shutdown.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import signal
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Coroutine, Optional
+
+from util.telemetry.telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+INFLIGHT_RUNS_GAUGE = "adk_inflight_agent_runs"
+BACKGROUND_TASKS_GAUGE = "adk_background_tasks"
+
+telemetry.describe(INFLIGHT_RUNS_GAUGE, "Agent runs currently in progress.")
+telemetry.describe(BACKGROUND_TASKS_GAUGE, "Background tasks not yet finished.")
+
+
+class DrainingError(Exception):
+    """Raised when new work is submitted while the process is draining."""
+
+    pass
+
+
+class InflightTracker:
+    """
+    Tracks in-flight agent runs and background tasks.
+
+    Once draining starts, new runs are rejected and ``drain`` waits for the
+    remaining work up to a deadline.
+    """
+
+    def __init__(self) -> None:
+        self.draining: bool = False
+        self._inflight: int = 0
+        self._idle: asyncio.Event = asyncio.Event()
+        self._idle.set()
+        self._background: set[asyncio.Task] = set()
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    @asynccontextmanager
+    async def track(self) -> AsyncIterator[None]:
+        """Count the enclosed block as an in-flight run."""
+        if self.draining:
+            raise DrainingError("Shutting down, not accepting new runs")
+
+        self._inflight += 1
+        self._idle.clear()
+        telemetry.set_gauge(INFLIGHT_RUNS_GAUGE, self._inflight)
+        try:
+            yield
+        finally:
+            self._inflight -= 1
+            telemetry.set_gauge(INFLIGHT_RUNS_GAUGE, self._inflight)
+            if self._inflight == 0:
+                self._idle.set()
+
+    def drain_on_signals(
+        self, signals: tuple[signal.Signals, ...] = (signal.SIGINT, signal.SIGTERM)
+    ) -> None:
+        """
+        Start draining as soon as one of ``signals`` arrives.
+
+        uvicorn runs the lifespan shutdown only after it has closed the
+        listener and waited for open requests, which is too late to turn
+        away runs that arrive on open connections meanwhile. Call this from
+        the lifespan startup: the server's own handlers are already installed
+        by then and are chained, so its shutdown proceeds unchanged.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+
+        for sig in signals:
+            previous = signal.getsignal(sig)
+            if not callable(previous):
+                continue
+
+            def handler(signum, frame, previous=previous) -> None:
+                self.draining = True
+                previous(signum, frame)
+
+            signal.signal(sig, handler)
+
+    def spawn(
+        self, coro: Coroutine, name: Optional[str] = None
+    ) -> Optional[asyncio.Task]:
+        """
+        Run a coroutine in the background and wait for it on shutdown.
+
+        Returns:
+            The task, or None if draining has started and the coroutine was
+            dropped, since it could be cancelled halfway at the drain deadline
+        """
+        if self.draining:
+            coro.close()
+            logger.info("Draining, not starting background task name=%s", name)
+            return None
+
+        task = asyncio.create_task(coro, name=name)
+        self._background.add(task)
+        telemetry.set_gauge(BACKGROUND_TASKS_GAUGE, len(self._background))
+        task.add_done_callback(self._on_background_done)
+        return task
+
+    def _on_background_done(self, task: asyncio.Task) -> None:
+        self._background.discard(task)
+        telemetry.set_gauge(BACKGROUND_TASKS_GAUGE, len(self._background))
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(
+                "Background task failed name=%s",
+                task.get_name(),
+                exc_info=task.exception(),
+            )
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Stop accepting runs and wait for in-flight and background work.
+
+        Args:
+            timeout: Seconds to wait before cancelling what is left
+
+        Returns:
+            True if everything finished before the deadline
+        """
+        self.draining = True
+        deadline = time.monotonic() + timeout
+        drained = True
+
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Drain deadline reached with %d runs in flight", self._inflight)
+            drained = False
+
+        pending = set(self._background)
+        if pending:
+            _, pending = await asyncio.wait(
+                pending, timeout=max(0.0, deadline - time.monotonic())
+            )
+        if pending:
+            logger.warning("Cancelled %d background tasks at drain deadline", len(pending))
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            drained = False
+
+        return drained
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+On-demand sampling profiler producing collapsed stacks, with optional
+per-route allocation statistics.
+
+Nothing runs until a profile is requested: a background thread then samples
+the stacks of all other threads at a fixed interval for the requested time.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from types import FrameType
+from typing import Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Longest first, so site-packages wins over the stdlib directory containing it
+_PATH_PREFIXES = sorted(
+    {os.path.join(os.path.abspath(path), "") for path in sys.path if path},
+    key=len,
+    reverse=True,
+)
+
+
+class ProfilerBusyError(Exception):
+    """Raised when a profile is requested while another one is running."""
+
+    pass
+
+
+@functools.lru_cache(maxsize=4096)
+def _short_path(filename: str) -> str:
+    """Trim a source path to its import-relative part."""
+    for prefix in _PATH_PREFIXES:
+        if filename.startswith(prefix):
+            return filename[len(prefix) :]
+    return filename
+
+
+def _collapse(frame: Optional[FrameType]) -> str:
+    """Format a stack as root-first, semicolon separated frames."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(
+            f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+        )
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class RouteAllocations:
+    """Requests and traced memory growth per route while allocations are tracked."""
+
+    def __init__(self) -> None:
+        self.requests: Counter[str] = Counter()
+        self.allocated: Counter[str] = Counter()
+
+    def add(self, route: str, allocated: int) -> None:
+        self.requests[route] += 1
+        self.allocated[route] += allocated
+
+    def render(self, snapshot: Optional[tracemalloc.Snapshot], top: int = 20) -> str:
+        lines = ["# route requests net_bytes bytes_per_request"]
+        for route, count in self.requests.most_common():
+            allocated = self.allocated[route]
+            lines.append(f"{route} {count} {allocated} {allocated // count}")
+        if snapshot is not None:
+            lines.append("")
+            lines.append("# top allocation sites: size count location")
+            for stat in snapshot.statistics("lineno")[:top]:
+                frame = stat.traceback[0]
+                lines.append(
+                    f"{stat.size} {stat.count} {_short_path(frame.filename)}:{frame.lineno}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """Samples all thread stacks for a fixed duration, one profile at a time."""
+
+    def __init__(self, interval: float = 0.01, max_seconds: float = 60.0):
+        """
+        Args:
+            interval: Seconds between samples
+            max_seconds: Longest profile that may be requested
+        """
+        self.interval: float = interval
+        self.max_seconds: float = max_seconds
+        self.allocations: Optional[RouteAllocations] = None
+        self._lock = threading.Lock()
+
+    async def profile(self, seconds: float) -> str:
+        """
+        Sample stacks for ``seconds`` and return them in collapsed format.
+
+        Each line is ``frame;frame;...;frame count``, root first, which
+        flamegraph.pl, speedscope and similar tools read directly.
+
+        Raises:
+            ProfilerBusyError: Another profile is running
+        """
+        seconds = min(seconds, self.max_seconds)
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("A profile is already running")
+        try:
+            stacks = await asyncio.to_thread(self._sample, seconds)
+        finally:
+            self._lock.release()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def _sample(self, seconds: float) -> Counter[str]:
+        stacks: Counter[str] = Counter()
+        own_thread = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                name = names.get(thread_id, f"thread-{thread_id}")
+                stacks[f"{name};{_collapse(frame)}"] += 1
+            time.sleep(self.interval)
+        return stacks
+
+    async def profile_allocations(self, seconds: float) -> str:
+        """
+        Track per-route allocations for ``seconds`` and return a text report.
+
+        Memory growth is measured around each request with tracemalloc, so
+        with concurrent requests a route is also charged for allocations of
+        requests overlapping it.
+
+        Raises:
+            ProfilerBusyError: Another profile is running
+        """
+        seconds = min(seconds, self.max_seconds)
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("A profile is already running")
+        started = not tracemalloc.is_tracing()
+        try:
+            if started:
+                tracemalloc.start()
+            self.allocations = RouteAllocations()
+            await asyncio.sleep(seconds)
+            snapshot = tracemalloc.take_snapshot()
+            return self.allocations.render(snapshot)
+        finally:
+            self.allocations = None
+            if started:
+                tracemalloc.stop()
+            self._lock.release()
+
+
+class AllocationTrackingMiddleware:
+    """Charges traced memory growth to the matched route while tracking is on."""
+
+    def __init__(self, app: ASGIApp, profiler: SamplingProfiler) -> None:
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or self.profiler.allocations is None:
+            await self.app(scope, receive, send)
+            return
+
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            allocations = self.profiler.allocations
+            endpoint = scope.get("endpoint")
+            if allocations is not None and endpoint is not None:
+                route = f"{scope['method']} {scope['path']}"
+                allocations.add(route, tracemalloc.get_traced_memory()[0] - before)
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Hedged requests, circuit breakers and deadline-bounded retries for
+outbound dependency calls.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from util.deadline.deadline import (
+    DeadlineExceededError,
+    RequestCancelledError,
+    current_request_context,
+)
+from util.telemetry.telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_HEDGES = "adk_dependency_hedges_total"
+_HEDGE_WINS = "adk_dependency_hedge_wins_total"
+_RETRIES = "adk_dependency_retries_total"
+_REJECTED = "adk_dependency_rejected_total"
+_CIRCUIT_STATE = "adk_dependency_circuit_state"
+_SATURATED = "adk_dependency_saturated_total"
+
+telemetry.describe(_HEDGES, "Hedged duplicate requests sent.")
+telemetry.describe(_HEDGE_WINS, "Hedged requests that finished first.")
+telemetry.describe(_RETRIES, "Retried dependency calls.")
+telemetry.describe(_REJECTED, "Calls rejected by an open circuit.")
+telemetry.describe(_CIRCUIT_STATE, "Circuit state (0 closed, 1 open, 2 half-open).")
+telemetry.describe(_SATURATED, "Calls given up waiting for a free worker.")
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the dependency's circuit is open."""
+
+    pass
+
+
+class DependencySaturatedError(Exception):
+    """Raised when all of a dependency's workers stay busy for too long."""
+
+    pass
+
+
+def _always_retry(exc: BaseException) -> bool:
+    return True
+
+
+class LatencyWindow:
+    """Sliding window of recent successful call latencies."""
+
+    def __init__(self, size: int = 200) -> None:
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def quantile(self, q: float) -> float:
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    """
+    Opens after consecutive failures, fails fast while open and lets a
+    single probe through once the reset timeout has passed.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name: str = name
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout: float = reset_timeout
+        self.state: int = self.CLOSED
+        self._failures: int = 0
+        self._opened_at: float = 0.0
+        self._probing: bool = False
+
+    def allow(self) -> bool:
+        """Return whether a call may proceed."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._set_state(self.HALF_OPEN)
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def release(self) -> None:
+        """Give back a probe slot without judging the dependency."""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._probing = False
+        if self.state != self.CLOSED:
+            logger.info("Circuit closed dependency=%s", self.name)
+            self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning("Circuit opened dependency=%s", self.name)
+            self._opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+    def _set_state(self, state: int) -> None:
+        self.state = state
+        telemetry.set_gauge(_CIRCUIT_STATE, state, dependency=self.name)
+
+
+class Dependency:
+    """
+    Resilience policy for calls to one external dependency.
+
+    Each attempt is bounded by ``timeout``. Once enough latencies have been
+    observed, an attempt still running after the p95 latency gets a hedged
+    duplicate and the first success wins. Retryable failures are retried
+    with full-jitter exponential backoff until ``max_attempts`` or the
+    deadline, and feed the circuit breaker.
+
+    Blocking calls run on the dependency's own bounded thread pool. A timed
+    out or hedged attempt cannot stop its thread, so the pool keeps an
+    unhealthy dependency from exhausting the event loop's default executor,
+    and hedges are only sent while a worker is free. An attempt waits for a
+    worker before its timeout starts; a call that finds no free worker in
+    time fails with DependencySaturatedError without judging the dependency.
+    The blocking client should use a timeout matching ``timeout`` so
+    abandoned attempts end.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float,
+        max_attempts: int = 3,
+        backoff_base: float = 0.05,
+        backoff_max: float = 1.0,
+        hedge: bool = True,
+        hedge_quantile: float = 0.95,
+        hedge_min_delay: float = 0.01,
+        hedge_min_samples: int = 20,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        retryable: Callable[[BaseException], bool] = _always_retry,
+        max_workers: Optional[int] = None,
+    ):
+        """
+        Args:
+            name: Dependency name used in logs and metrics
+            timeout: Seconds allowed for a single attempt
+            max_attempts: Maximum attempts including the first
+            backoff_base: Base delay of the exponential backoff in seconds
+            backoff_max: Cap of a single backoff delay in seconds
+            hedge: Whether slow attempts get a hedged duplicate
+            hedge_quantile: Latency quantile after which an attempt is hedged
+            hedge_min_delay: Lower bound of the hedge delay in seconds
+            hedge_min_samples: Latencies to observe before hedging starts
+            failure_threshold: Consecutive failures that open the circuit
+            reset_timeout: Seconds the circuit stays open before a probe
+            retryable: Predicate for failures worth retrying; others are
+                raised immediately and do not count against the circuit
+            max_workers: Threads for blocking calls; without it they run on
+                the default executor and are never hedged
+        """
+        self.name: str = name
+        self.timeout: float = timeout
+        self.max_attempts: int = max_attempts
+        self.backoff_base: float = backoff_base
+        self.backoff_max: float = backoff_max
+        self.hedge: bool = hedge
+        self.hedge_quantile: float = hedge_quantile
+        self.hedge_min_delay: float = hedge_min_delay
+        self.hedge_min_samples: int = hedge_min_samples
+        self.retryable: Callable[[BaseException], bool] = retryable
+        self.breaker: CircuitBreaker = CircuitBreaker(
+            name, failure_threshold=failure_threshold, reset_timeout=reset_timeout
+        )
+        self.latencies: LatencyWindow = LatencyWindow()
+        self.max_workers: Optional[int] = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = (
+            ThreadPoolExecutor(max_workers, thread_name_prefix=f"dependency-{name}")
+            if max_workers
+            else None
+        )
+        self._busy: int = 0
+        self._busy_lock = threading.Lock()
+        self._worker_freed: asyncio.Event = asyncio.Event()
+
+    def close(self) -> None:
+        """Stop the blocking-call threads once their current calls finish."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Return the delay before hedging, or None if hedging is not active."""
+        if not self.hedge or len(self.latencies) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, self.latencies.quantile(self.hedge_quantile))
+
+    async def call_blocking(
+        self, fn: Callable[[], T], deadline: Optional[float] = None
+    ) -> T:
+        """
+        Call the blocking ``fn`` on this dependency's threads under this policy.
+
+        Each attempt first waits for a free worker, at most ``timeout``
+        seconds; the attempt's timeout starts once the worker picks it up.
+
+        Args:
+            fn: Blocking function run once per attempt
+            deadline: Absolute time.monotonic() by which the call must finish,
+                defaults to the deadline of the current request
+
+        Raises:
+            CircuitOpenError: The circuit is open
+            DependencySaturatedError: No worker became free in time
+            DeadlineExceededError: No time left for another attempt
+            RequestCancelledError: The current request was cancelled
+        """
+        return await self.call(lambda: self._submit_blocking(fn), deadline, blocking=True)
+
+    def _submit_blocking(self, fn: Callable[[], T]) -> asyncio.Future:
+        """Start ``fn`` on a worker reserved by the caller."""
+        run = functools.partial(contextvars.copy_context().run, fn)
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            return loop.run_in_executor(None, run)
+
+        try:
+            future = self._executor.submit(run)
+        except BaseException:
+            self._release_worker(loop)
+            raise
+        # Reserved until the thread is done, even if the attempt was abandoned
+        future.add_done_callback(lambda _: self._release_worker(loop))
+        return asyncio.wrap_future(future)
+
+    def _try_reserve_worker(self) -> bool:
+        with self._busy_lock:
+            if self._busy >= self.max_workers:
+                return False
+            self._busy += 1
+            return True
+
+    def _release_worker(self, loop: asyncio.AbstractEventLoop) -> None:
+        with self._busy_lock:
+            self._busy -= 1
+        try:
+            loop.call_soon_threadsafe(self._worker_freed.set)
+        except RuntimeError:
+            # The loop is already closed, nobody is waiting
+            pass
+
+    async def _reserve_worker(self, deadline: Optional[float]) -> None:
+        """Wait for a free worker, bounded by ``timeout`` and the deadline."""
+        if self._executor is None:
+            return
+
+        wait_until = time.monotonic() + self.timeout
+        if deadline is not None:
+            wait_until = min(wait_until, deadline)
+        while not self._try_reserve_worker():
+            self._worker_freed.clear()
+            if self._try_reserve_worker():
+                return
+            remaining = wait_until - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                await asyncio.wait_for(self._worker_freed.wait(), remaining)
+            except asyncio.TimeoutError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise DeadlineExceededError(
+                        f"Deadline exceeded waiting for {self.name}"
+                    ) from None
+                telemetry.increment(_SATURATED, dependency=self.name)
+                raise DependencySaturatedError(
+                    f"No free worker for {self.name} after {self.timeout:.3f}s"
+                ) from None
+
+    def _can_hedge(self, blocking: bool) -> bool:
+        """Reserve a worker for a hedge of a blocking call if one is free."""
+        if not blocking:
+            return True
+        if self._executor is None:
+            return False
+        return self._try_reserve_worker()
+
+    async def call(
+        self,
+        fn: Callable[[], Awaitable[T]],
+        deadline: Optional[float] = None,
+        blocking: bool = False,
+    ) -> T:
+        """
+        Call ``fn`` under this policy.
+
+        Args:
+            fn: Factory returning a new awaitable per attempt
+            deadline: Absolute time.monotonic() by which the call must finish,
+                defaults to the deadline of the current request
+            blocking: Whether ``fn`` occupies a thread, so hedging must
+                wait for a free worker
+
+        Raises:
+            CircuitOpenError: The circuit is open
+            DeadlineExceededError: No time left for another attempt
+            RequestCancelledError: The current request was cancelled
+        """
+        context = current_request_context()
+        if deadline is None and context is not None:
+            deadline = context.deadline
+
+        attempt = 0
+        while True:
+            attempt += 1
+            if context is not None and context.cancelled:
+                raise RequestCancelledError(f"Request cancelled calling {self.name}")
+            timeout = self.timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    raise DeadlineExceededError(f"Deadline exceeded calling {self.name}")
+
+            if not self.breaker.allow():
+                telemetry.increment(_REJECTED, dependency=self.name)
+                raise CircuitOpenError(f"Circuit open for {self.name}")
+
+            if blocking:
+                # Waiting for our own threads says nothing about the dependency
+                try:
+                    await self._reserve_worker(deadline)
+                except BaseException:
+                    self.breaker.release()
+                    raise
+                if deadline is not None:
+                    timeout = min(self.timeout, deadline - time.monotonic())
+
+            try:
+                result = await self._attempt(fn, timeout, blocking)
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as exc:
+                if isinstance(exc, asyncio.TimeoutError) and timeout < self.timeout:
+                    # Cut short by the caller's deadline, not the dependency's fault
+                    self.breaker.release()
+                    raise DeadlineExceededError(
+                        f"Deadline exceeded calling {self.name}"
+                    ) from exc
+                if isinstance(exc, asyncio.TimeoutError) or self.retryable(exc):
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.release()
+                    raise
+
+                if attempt >= self.max_attempts:
+                    raise
+                backoff = random.uniform(
+                    0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+                )
+                if deadline is not None and time.monotonic() + backoff >= deadline:
+                    raise
+                logger.warning(
+                    "Retrying dependency=%s attempt=%d error=%r",
+                    self.name,
+                    attempt,
+                    exc,
+                )
+                telemetry.increment(_RETRIES, dependency=self.name)
+                await asyncio.sleep(backoff)
+                continue
+
+            self.breaker.record_success()
+            return result
+
+    async def _attempt(
+        self, fn: Callable[[], Awaitable[T]], timeout: float, blocking: bool = False
+    ) -> T:
+        started = time.monotonic()
+        primary = asyncio.ensure_future(fn())
+        tasks = {primary}
+        started_at = {primary: started}
+        try:
+            delay = self.hedge_delay()
+            if delay is not None and delay < timeout:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self._can_hedge(blocking):
+                    telemetry.increment(_HEDGES, dependency=self.name)
+                    hedged = asyncio.ensure_future(fn())
+                    tasks.add(hedged)
+                    started_at[hedged] = time.monotonic()
+
+            remaining = timeout - (time.monotonic() - started)
+            error: Optional[BaseException] = None
+            while tasks and remaining > 0:
+                done, _ = await asyncio.wait(
+                    tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None:
+                        if task is not primary:
+                            telemetry.increment(_HEDGE_WINS, dependency=self.name)
+                        self.latencies.add(time.monotonic() - started_at[task])
+                        return task.result()
+                    error = task.exception()
+                remaining = timeout - (time.monotonic() - started)
+
+            if not tasks and error is not None:
+                raise error
+            raise asyncio.TimeoutError(f"{self.name} timed out after {timeout:.3f}s")
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Server-side session storage keyed by an opaque cookie id.
+"""
+
+from __future__ import annotations
+
+import copy
+import secrets
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from util.telemetry.telemetry import telemetry
+
+
+class InMemorySessionStore:
+    """Bounded LRU map of session id to session data with TTL eviction."""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 14 * 24 * 60 * 60):
+        self.max_entries: int = max_entries
+        self.ttl: float = ttl
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    def get(self, session_id: str) -> Optional[dict]:
+        """Return the session data, or None if missing or expired."""
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+
+        expires_at, data = entry
+        if expires_at <= time.monotonic():
+            del self._entries[session_id]
+            return None
+
+        self._entries.move_to_end(session_id)
+        return data
+
+    def set(self, session_id: str, data: dict) -> None:
+        """Store session data and evict the least recently used entries."""
+        self._entries[session_id] = (time.monotonic() + self.ttl, data)
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, session_id: str) -> None:
+        """Remove a session."""
+        self._entries.pop(session_id, None)
+
+
+class ServerSideSessionMiddleware:
+    """
+    Drop-in replacement for Starlette's SessionMiddleware that keeps session
+    data in a server-side store.
+
+    The cookie carries only a random id, so requests skip cookie signing and
+    JSON/base64 work, and Set-Cookie is only sent when a session is created,
+    rotated or cleared. The id is rotated whenever the value under
+    ``auth_key`` changes (login, logout, switching accounts), so an id
+    planted before login never becomes an authenticated one.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        store: InMemorySessionStore,
+        session_cookie: str = "session",
+        max_age: Optional[int] = 14 * 24 * 60 * 60,
+        path: str = "/",
+        same_site: str = "lax",
+        https_only: bool = False,
+        auth_key: str = "user",
+    ) -> None:
+        self.app = app
+        self.store = store
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.path = path
+        self.auth_key = auth_key
+        self.security_flags = "httponly; samesite=" + same_site
+        if https_only:
+            self.security_flags += "; secure"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        connection = HTTPConnection(scope)
+        session_id: Optional[str] = connection.cookies.get(self.session_cookie)
+        stored: Optional[dict] = self.store.get(session_id) if session_id else None
+        telemetry.record_cache("session", hit=stored is not None)
+        if stored is None:
+            # Unknown or expired ids are never adopted, a new one is minted
+            session_id = None
+
+        scope["session"] = copy.deepcopy(stored) if stored else {}
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                self._commit(scope["session"], session_id, stored, message)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _commit(
+        self,
+        session: dict,
+        session_id: Optional[str],
+        stored: Optional[dict],
+        message: Message,
+    ) -> None:
+        if session:
+            if session_id is not None and session.get(self.auth_key) != (
+                stored or {}
+            ).get(self.auth_key):
+                # Authentication state changed, never keep the previous id
+                self.store.delete(session_id)
+                session_id = None
+
+            if session_id is None:
+                session_id = secrets.token_urlsafe(32)
+                self.store.set(session_id, copy.deepcopy(session))
+                self._set_cookie(message, session_id, self.max_age)
+            elif session != stored:
+                self.store.set(session_id, copy.deepcopy(session))
+        elif session_id is not None:
+            self.store.delete(session_id)
+            self._set_cookie(message, "null", 0)
+
+    def _set_cookie(self, message: Message, value: str, max_age: Optional[int]) -> None:
+        headers = MutableHeaders(scope=message)
+        cookie = f"{self.session_cookie}={value}; path={self.path}; "
+        if max_age is not None:
+            cookie += f"Max-Age={max_age}; "
+        if max_age == 0:
+            cookie += "expires=Thu, 01 Jan 1970 00:00:00 GMT; "
+        headers.append("Set-Cookie", cookie + self.security_flags)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Lightweight tracing and Prometheus-style metrics for hot-path stages.
+"""
+
+from __future__ import annotations
+
+import bisect
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from typing import ContextManager, Optional
+
+from opentelemetry import trace
+
+logger = logging.getLogger(__name__)
+
+tracer = trace.get_tracer(__name__)
+
+DEFAULT_BUCKETS: tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+_STAGE_HISTOGRAM = "adk_stage_duration_seconds"
+_STAGE_ERRORS = "adk_stage_errors_total"
+_CACHE_REQUESTS = "adk_cache_requests_total"
+
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "request_id", default=None
+)
+_model_started: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "model_started", default=None
+)
+
+_NOOP_SPAN: ContextManager[None] = nullcontext()
+
+
+def new_request_id(request_id: Optional[str] = None) -> str:
+    """Bind a request id to the current context and return it."""
+    request_id = request_id or uuid.uuid4().hex
+    _request_id.set(request_id)
+    return request_id
+
+
+def current_request_id() -> Optional[str]:
+    """Return the request id bound to the current context, if any."""
+    return _request_id.get()
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+class _Histogram:
+    """Cumulative histogram with fixed bucket bounds."""
+
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Span:
+    """Times a stage, records it in the histogram and emits an OpenTelemetry span."""
+
+    __slots__ = ("_telemetry", "_stage", "_otel", "_started")
+
+    def __init__(self, telemetry: Telemetry, stage: str) -> None:
+        self._telemetry = telemetry
+        self._stage = stage
+
+    def __enter__(self) -> None:
+        self._otel = tracer.start_as_current_span(f"stage {self._stage}")
+        span = self._otel.__enter__()
+        request_id = _request_id.get()
+        if request_id:
+            span.set_attribute("request_id", request_id)
+        self._started = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        elapsed = time.perf_counter() - self._started
+        self._telemetry.observe(self._stage, elapsed, failed=exc_type is not None)
+        self._otel.__exit__(exc_type, exc, tb)
+        logger.debug(
+            "span stage=%s request_id=%s duration_ms=%.2f",
+            self._stage,
+            _request_id.get(),
+            elapsed * 1000,
+        )
+
+
+class Telemetry:
+    """
+    Per-stage latency histograms, counters and gauges.
+
+    All recording methods return immediately when disabled, so instrumented
+    code pays a single attribute check on the hot path.
+
+    Metrics are kept per process. With several workers each one answers
+    /metrics with its own series, so ``const_labels`` should identify the
+    worker to keep series from different workers apart.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+        const_labels: Optional[dict[str, str]] = None,
+    ) -> None:
+        self.enabled: bool = enabled
+        self.buckets: tuple[float, ...] = buckets
+        self.const_labels: dict[str, str] = dict(const_labels or {})
+        self._lock = threading.Lock()
+        self._histograms: dict[str, _Histogram] = {}
+        self._counters: dict[str, dict[tuple[tuple[str, str], ...], float]] = {}
+        self._gauges: dict[str, dict[tuple[tuple[str, str], ...], float]] = {}
+        self._help: dict[str, str] = {
+            _STAGE_HISTOGRAM: "Latency of hot-path stages in seconds.",
+            _STAGE_ERRORS: "Number of hot-path stages that raised.",
+            _CACHE_REQUESTS: "Cache lookups by cache and result.",
+        }
+
+    def span(self, stage: str) -> ContextManager[None]:
+        """Return a context manager timing the given stage."""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, stage)
+
+    def observe(self, stage: str, seconds: float, failed: bool = False) -> None:
+        """Record a stage duration."""
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = _Histogram(self.buckets)
+            histogram.observe(seconds)
+        if failed:
+            self.increment(_STAGE_ERRORS, stage=stage)
+
+    def record_cache(self, cache: str, hit: bool) -> None:
+        """Count a cache lookup as a hit or a miss."""
+        if not self.enabled:
+            return
+        self.increment(_CACHE_REQUESTS, cache=cache, result="hit" if hit else "miss")
+
+    def increment(self, name: str, value: float = 1.0, **labels: str) -> None:
+        """Increment a counter."""
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        """Set a gauge to the given value."""
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+
+    def describe(self, name: str, help_text: str) -> None:
+        """Register the HELP text for a metric family."""
+        self._help[name] = help_text
+
+    def before_model_callback(self, callback_context, llm_request) -> None:
+        """ADK before_model_callback that starts the model latency timer."""
+        if self.enabled:
+            _model_started.set(time.perf_counter())
+        return None
+
+    def after_model_callback(self, callback_context, llm_response) -> None:
+        """ADK after_model_callback that records the model latency."""
+        started = _model_started.get()
+        if self.enabled and started is not None:
+            _model_started.set(None)
+            self.observe("llm_generate", time.perf_counter() - started)
+        return None
+
+    def render_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines: list[str] = []
+        const = tuple(sorted(self.const_labels.items()))
+        with self._lock:
+            if self._histograms:
+                lines.append(f"# HELP {_STAGE_HISTOGRAM} {self._help[_STAGE_HISTOGRAM]}")
+                lines.append(f"# TYPE {_STAGE_HISTOGRAM} histogram")
+                for stage, histogram in sorted(self._histograms.items()):
+                    cumulative = 0
+                    for bound, count in zip(
+                        (*histogram.buckets, float("inf")), histogram.counts
+                    ):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        labels = _format_labels(const + (("stage", stage), ("le", le)))
+                        lines.append(f"{_STAGE_HISTOGRAM}_bucket{labels} {cumulative}")
+                    labels = _format_labels(const + (("stage", stage),))
+                    lines.append(f"{_STAGE_HISTOGRAM}_sum{labels} {histogram.sum}")
+                    lines.append(f"{_STAGE_HISTOGRAM}_count{labels} {histogram.count}")
+
+            for kind, families in (("counter", self._counters), ("gauge", self._gauges)):
+                for name, series in sorted(families.items()):
+                    if name in self._help:
+                        lines.append(f"# HELP {name} {self._help[name]}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for labels, value in sorted(series.items()):
+                        lines.append(f"{name}{_format_labels(const + labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+telemetry: Telemetry = Telemetry()
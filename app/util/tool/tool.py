@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Per-turn concurrency limit for agent tool calls.
+
+ADK starts every function call of a model turn as its own task and merges
+the responses in call order, so coroutine tools already overlap. The limit
+bounds how many of them run at once for one invocation, e.g. to stay within
+per-user API quotas when the model fans out.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable
+
+from google.adk.tools import FunctionTool, ToolContext
+
+
+class ToolConcurrencyLimiter:
+    """Semaphore per invocation, dropped once its last tool call finishes."""
+
+    def __init__(self, max_concurrency: int = 0):
+        """
+        Args:
+            max_concurrency: Tool calls allowed to run at once per invocation
+                (1 runs them one after another, 0 means no limit)
+        """
+        self.max_concurrency: int = max_concurrency
+        self._slots: dict[str, tuple[asyncio.Semaphore, int]] = {}
+
+    @asynccontextmanager
+    async def slot(self, tool_context: ToolContext) -> AsyncIterator[None]:
+        """Hold one of the invocation's tool slots for the enclosed block."""
+        if self.max_concurrency <= 0:
+            yield
+            return
+
+        key = tool_context.invocation_id
+        semaphore, users = self._slots.get(key) or (
+            asyncio.Semaphore(self.max_concurrency),
+            0,
+        )
+        self._slots[key] = (semaphore, users + 1)
+        try:
+            async with semaphore:
+                yield
+        finally:
+            semaphore, users = self._slots[key]
+            if users == 1:
+                del self._slots[key]
+            else:
+                self._slots[key] = (semaphore, users - 1)
+
+
+class BoundedFunctionTool(FunctionTool):
+    """FunctionTool whose calls share a per-invocation concurrency limit."""
+
+    def __init__(
+        self, func: Callable[..., Any], limiter: ToolConcurrencyLimiter, **kwargs
+    ):
+        super().__init__(func, **kwargs)
+        self.limiter = limiter
+
+    async def run_async(self, *, args: dict[str, Any], tool_context: ToolContext) -> Any:
+        async with self.limiter.slot(tool_context):
+            return await super().run_async(args=args, tool_context=tool_context)
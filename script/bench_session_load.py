@@ -0,0 +1,88 @@
+"""
+Measure session load time against history length, before and after
+compaction with AgentClient.compact_session.
+
+Uses ADK's InMemorySessionService, so it shows the cost that grows with
+history on our side (event parsing and copying); with VertexAiSessionService
+every additional page of events adds a network round trip on top. Run with:
+
+    uv run script/bench_session_load.py --lengths 10 100 1000 5000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from google.adk.agents import Agent  # noqa: E402
+from google.adk.events import Event  # noqa: E402
+from google.adk.sessions import InMemorySessionService  # noqa: E402
+from google.genai import types  # noqa: E402
+from util.agent.agent import AgentClient  # noqa: E402
+
+APP_NAME = "bench"
+USER_ID = "bench@example.com"
+
+
+async def _populate(service: InMemorySessionService, events: int) -> str:
+    session = await service.create_session(
+        app_name=APP_NAME, user_id=USER_ID, state={"user:google": "x" * 300}
+    )
+    for i in range(events):
+        author, role = ("user", "user") if i % 2 == 0 else ("agent", "model")
+        await service.append_event(
+            session,
+            Event(
+                invocation_id=f"inv-{i // 2}",
+                author=author,
+                content=types.Content(
+                    role=role, parts=[types.Part(text=f"message {i} " + "lorem " * 40)]
+                ),
+            ),
+        )
+    return session.id
+
+
+async def _load_time(service: InMemorySessionService, session_id: str, runs: int) -> float:
+    started = time.perf_counter()
+    for _ in range(runs):
+        await service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=session_id)
+    return (time.perf_counter() - started) / runs
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--keep", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'events':>8} {'load_ms':>10} {'compacted_ms':>13} {'kept':>5}")
+    for length in args.lengths:
+        service = InMemorySessionService()
+        client = AgentClient(
+            session_service=service,
+            app_name=APP_NAME,
+            agent=Agent(name="agent", model="gemini-2.5-flash"),
+            compaction_max_events=args.keep,
+            compaction_keep_events=args.keep,
+        )
+        session_id = await _populate(service, length)
+        before = await _load_time(service, session_id, args.runs)
+
+        compacted_id = await client.compact_session(USER_ID, session_id) or session_id
+        after = await _load_time(service, compacted_id, args.runs)
+        kept = await service.get_session(
+            app_name=APP_NAME, user_id=USER_ID, session_id=compacted_id
+        )
+        print(
+            f"{length:>8} {before * 1000:>10.2f} {after * 1000:>13.2f} "
+            f"{len(kept.events):>5}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+"""
+Compare the legacy and compact encodings of encrypted refresh tokens.
+
+A local AES-GCM key stands in for the KMS-held KEK, with an injected
+round-trip latency per unwrap. Prints the stored size and decode time of
+each encoding, and of the compact encoding with the DEK cache enabled.
+The compact encoding is about as large as the legacy one; its gains are the
+KEK hint and the DEK cache, which is why it is written only with
+COMPACT_TOKEN_FORMAT. Run with:
+
+    uv run script/bench_token_format.py --tokens 200 --kms-latency 0.02
+"""
+
+import argparse
+import base64
+import logging
+import os
+import secrets
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import tink  # noqa: E402
+from tink import aead  # noqa: E402
+from util.envelope.envelope_aead import EnvelopeAEAD  # noqa: E402
+
+
+class LocalKek(aead.Aead):
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.calls = 0
+        self._aead = tink.new_keyset_handle(
+            aead.aead_key_templates.AES256_GCM
+        ).primitive(aead.Aead)
+
+    def encrypt(self, plaintext: bytes, associated_data: bytes) -> bytes:
+        return self._aead.encrypt(plaintext, associated_data)
+
+    def decrypt(self, ciphertext: bytes, associated_data: bytes) -> bytes:
+        self.calls += 1
+        time.sleep(self.latency)
+        return self._aead.decrypt(ciphertext, associated_data)
+
+
+class BenchEnvelopeAEAD(EnvelopeAEAD):
+    latency = 0.0
+
+    def _get_remote_aead(self, kek_uri, credentials_path):
+        return LocalKek(self.latency)
+
+
+def _measure(envelope: EnvelopeAEAD, values: list[tuple[str, str]], rounds: int) -> list[float]:
+    latencies = []
+    for _ in range(rounds):
+        for encoded, user_id in values:
+            started = time.perf_counter()
+            envelope.decrypt_token(encoded, user_id)
+            latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--kms-latency", type=float, default=0.02)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    BenchEnvelopeAEAD.latency = args.kms_latency
+    kek_uri = "gcp-kms://projects/bench/locations/global/keyRings/bench/cryptoKeys/kek"
+    plain = BenchEnvelopeAEAD(kek_uri)
+    cached = BenchEnvelopeAEAD(kek_uri, dek_cache_ttl=300)
+    # Share the KEK so both instances read the same values
+    cached.remote_aead = plain.remote_aead
+    cached._remote_aeads = plain._remote_aeads
+
+    tokens = [("1//" + secrets.token_urlsafe(72), f"user-{i}") for i in range(args.tokens)]
+    legacy, compact = [], []
+    for token, user_id in tokens:
+        ciphertext = plain._encrypt(token.encode(), user_id.encode())
+        legacy.append((base64.b64encode(ciphertext).decode(), user_id))
+        compact.append((plain.encode_envelope(ciphertext), user_id))
+
+    for encoded, user_id in compact[:3]:
+        assert plain.decrypt_token(encoded, user_id) == cached.decrypt_token(encoded, user_id)
+
+    results = {
+        "legacy": (legacy, plain),
+        "compact": (compact, plain),
+        "compact+dek": (compact, cached),
+    }
+    for name, (values, envelope) in results.items():
+        kek = envelope._remote_aeads[envelope.kek_hint][0]
+        kek.calls = 0
+        latencies = _measure(envelope, values, args.rounds)
+        size = statistics.mean(len(encoded) for encoded, _ in values)
+        print(
+            f"{name:<12} size={size:6.1f} chars "
+            f"p50={statistics.median(latencies) * 1000:6.2f}ms "
+            f"mean={statistics.mean(latencies) * 1000:6.2f}ms "
+            f"kms_calls={kek.calls}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Measure turn latency when the model asks for several tools in one turn.
+
+A fake LLM answers each new question with N function calls across three
+tools built on Credential, the way profile, Drive or Calendar lookups
+would be. The tools run once sequentially (TOOL_CONCURRENCY=1), once capped
+and once unlimited. Token refresh and the API calls are stand-ins with
+injected latency. Each turn uses a fresh user, so every turn starts with
+a cold credential. Run with:
+
+    uv run script/bench_tool_concurrency.py --calls 6 --turns 5
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+from typing import AsyncGenerator
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from google.adk.agents import Agent  # noqa: E402
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse  # noqa: E402
+from google.adk.runners import Runner  # noqa: E402
+from google.adk.sessions import InMemorySessionService  # noqa: E402
+from google.adk.tools import ToolContext  # noqa: E402
+from google.genai import types  # noqa: E402
+from util.credential.credential import Credential  # noqa: E402
+from util.tool.tool import BoundedFunctionTool, ToolConcurrencyLimiter  # noqa: E402
+
+STATE_KEY = "user:google"
+TOOLS = ["get_profile", "list_files", "list_events"]
+
+
+class StubEnvelopeAEAD:
+    def decrypt_token(self, encrypted_token: str, user_id: str) -> str:
+        time.sleep(0.02)
+        return "refresh-token"
+
+
+class StubOAuthSession:
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.calls = 0
+
+    def refresh_token(self, refresh_token: str) -> dict:
+        self.calls += 1
+        time.sleep(self.latency)
+        return {"access_token": "access-token", "expires_in": 3600}
+
+
+class FanOutLlm(BaseLlm):
+    """Requests ``calls`` tool calls for a question, then answers with their results."""
+
+    calls: int = 3
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        last = llm_request.contents[-1]
+        responses = [part.function_response for part in last.parts if part.function_response]
+        if responses:
+            text = ",".join(str(response.response["result"]) for response in responses)
+            yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=text)]))
+            return
+
+        parts = [
+            types.Part(
+                function_call=types.FunctionCall(
+                    id=f"call-{i}", name=TOOLS[i % len(TOOLS)], args={"index": i}
+                )
+            )
+            for i in range(self.calls)
+        ]
+        yield LlmResponse(content=types.Content(role="model", parts=parts))
+
+
+def _make_tools(credential: Credential, api_latency: float):
+    async def call_api(tool_context: ToolContext, index: int) -> str:
+        access_token = await credential.get_access_token_from_context(
+            tool_context=tool_context, state_key=STATE_KEY
+        )
+        assert access_token
+        await asyncio.sleep(api_latency)
+        return f"{index}"
+
+    async def get_profile(tool_context: ToolContext, index: int) -> str:
+        """Get the user's profile."""
+        return await call_api(tool_context, index)
+
+    async def list_files(tool_context: ToolContext, index: int) -> str:
+        """List the user's files."""
+        return await call_api(tool_context, index)
+
+    async def list_events(tool_context: ToolContext, index: int) -> str:
+        """List the user's calendar events."""
+        return await call_api(tool_context, index)
+
+    return [get_profile, list_files, list_events]
+
+
+async def _run_mode(concurrency: int, args: argparse.Namespace) -> tuple[list[float], float]:
+    oauth_session = StubOAuthSession(args.refresh_latency)
+    credential = Credential(envelope_aead=StubEnvelopeAEAD(), oauth_session=oauth_session)
+    limiter = ToolConcurrencyLimiter(concurrency)
+    agent = Agent(
+        name="agent",
+        model=FanOutLlm(model="fake", calls=args.calls),
+        tools=[
+            BoundedFunctionTool(func, limiter=limiter)
+            for func in _make_tools(credential, args.api_latency)
+        ],
+        after_agent_callback=credential.clear_invocation,
+    )
+    session_service = InMemorySessionService()
+    runner = Runner(agent=agent, app_name="bench", session_service=session_service)
+    expected = ",".join(str(i) for i in range(args.calls))
+
+    latencies = []
+    for turn in range(args.turns):
+        user_id = f"user-{turn}"
+        session = await session_service.create_session(
+            app_name="bench", user_id=user_id, state={STATE_KEY: "encrypted"}
+        )
+        started = time.perf_counter()
+        final = None
+        async for event in runner.run_async(
+            user_id=user_id,
+            session_id=session.id,
+            new_message=types.Content(role="user", parts=[types.Part(text="hi")]),
+        ):
+            if event.is_final_response():
+                final = event.content.parts[0].text
+        latencies.append(time.perf_counter() - started)
+        assert final == expected, f"results out of order: {final}"
+
+    return latencies, oauth_session.calls / args.turns
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=6)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=4)
+    parser.add_argument("--refresh-latency", type=float, default=0.08)
+    parser.add_argument("--api-latency", type=float, default=0.1)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    for name, concurrency in (
+        ("sequential", 1),
+        (f"limit={args.limit}", args.limit),
+        ("unlimited", 0),
+    ):
+        latencies, refreshes = await _run_mode(concurrency, args)
+        print(
+            f"{name:<11} calls/turn={args.calls} "
+            f"p50={statistics.median(latencies) * 1000:6.1f}ms "
+            f"max={max(latencies) * 1000:6.1f}ms "
+            f"refreshes/turn={refreshes:.1f} order=ok"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,156 @@
+"""
+Benchmark uvicorn throughput on CPU-bound request paths by worker count.
+
+Each request verifies an ES256 JWT, signs a session cookie and round-trips an
+AES-GCM ciphertext, mirroring the per-request work of the app without any
+network dependencies. Run with:
+
+    uv run script/bench_workers.py --workers 1 2 4 --duration 10
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from itsdangerous import TimestampSigner
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+
+_signing_key = ec.generate_private_key(ec.SECP256R1())
+_assertion = jwt.encode(
+    {"email": "bench@example.com", "aud": "bench", "iss": "bench"},
+    _signing_key,
+    algorithm="ES256",
+)
+_signer = TimestampSigner("bench-secret")
+_aead = AESGCM(AESGCM.generate_key(bit_length=256))
+
+
+async def handle(request: Request) -> PlainTextResponse:
+    claim = jwt.decode(
+        _assertion,
+        _signing_key.public_key(),
+        algorithms=["ES256"],
+        audience="bench",
+        issuer="bench",
+    )
+    session = base64.b64encode(json.dumps({"user": claim}).encode())
+    cookie = _signer.sign(session)
+    _signer.unsign(cookie)
+    nonce = os.urandom(12)
+    ciphertext = _aead.encrypt(nonce, b"refresh-token" * 8, claim["email"].encode())
+    _aead.decrypt(nonce, ciphertext, claim["email"].encode())
+    return PlainTextResponse("ok")
+
+
+app = Starlette()
+app.add_route("/", handle)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _load(url: str, duration: float, concurrency: int) -> int:
+    completed = 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits) as client:
+
+        async def worker() -> None:
+            nonlocal completed
+            while time.perf_counter() < deadline:
+                response = await client.get(url)
+                response.raise_for_status()
+                completed += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return completed
+
+
+def _load_process(url: str, duration: float, concurrency: int) -> int:
+    return asyncio.run(_load(url, duration, concurrency))
+
+
+async def _wait_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                if time.perf_counter() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+def run(workers: int, duration: float, concurrency: int, clients: int) -> float:
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/"
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "bench_workers:app",
+            "--app-dir",
+            os.path.dirname(os.path.abspath(__file__)),
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ]
+    )
+    try:
+        asyncio.run(_wait_ready(url))
+        # Drive load from several processes so the client is not the bottleneck.
+        with ProcessPoolExecutor(clients) as pool:
+            futures = [
+                pool.submit(_load_process, url, duration, concurrency // clients)
+                for _ in range(clients)
+            ]
+            completed = sum(future.result() for future in futures)
+        return completed / duration
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--clients", type=int, default=4)
+    args = parser.parse_args()
+
+    print(
+        f"cpus={os.cpu_count()} concurrency={args.concurrency} clients={args.clients}"
+    )
+    baseline = None
+    for workers in args.workers:
+        rps = run(workers, args.duration, args.concurrency, args.clients)
+        baseline = baseline or rps
+        print(f"workers={workers:<3} rps={rps:9.1f} speedup={rps / baseline:4.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Check that plaintext tokens do not outlive the agent turn that used them.
+
+Runs agent turns against a stand-in model, KMS and token endpoint (no Google
+services needed) and exits non-zero if, once a turn has ended, anything in
+the process still refers to the decrypted refresh token or the access token:
+
+- a turn whose tool call succeeds
+- a turn whose tool raises after fetching the token
+- a turn cancelled while its tool is running
+
+With a process-wide access token cache (as enabled by CREDENTIAL_PREWARM)
+only the cache may still hold the access token. Run with:
+
+    uv run script/check_credential_lifetime.py
+"""
+
+import asyncio
+import gc
+import logging
+import os
+import sys
+from types import FrameType
+from typing import AsyncGenerator
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from google.adk.agents import Agent  # noqa: E402
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse  # noqa: E402
+from google.adk.sessions import InMemorySessionService  # noqa: E402
+from google.adk.tools import ToolContext  # noqa: E402
+from google.genai import types  # noqa: E402
+from util.agent.agent import AgentClient  # noqa: E402
+from util.credential.credential import Credential  # noqa: E402
+
+STATE_KEY = "user:google"
+
+
+class StubEnvelopeAEAD:
+    def __init__(self) -> None:
+        self.refresh_token = "".join(["refresh-", os.urandom(8).hex()])
+
+    def decrypt_token(self, encrypted_token: str, user_id: str) -> str:
+        return self.refresh_token
+
+
+class StubOAuthSession:
+    def __init__(self) -> None:
+        self.access_token = "".join(["access-", os.urandom(8).hex()])
+
+    def refresh_token(self, refresh_token: str) -> dict:
+        return {"access_token": self.access_token, "expires_in": 3600}
+
+
+class ToolCallLlm(BaseLlm):
+    """Calls the tool once, then answers."""
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        if llm_request.contents[-1].parts[0].function_response:
+            text = "done"
+            yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=text)]))
+            return
+        call = types.FunctionCall(id="call", name="use_token", args={})
+        yield LlmResponse(
+            content=types.Content(role="model", parts=[types.Part(function_call=call)])
+        )
+
+
+def _holders(value: str, owner: dict) -> list[str]:
+    """Types of the objects still referring to ``value``, besides its stand-in."""
+    gc.collect()
+    return [
+        type(referrer).__name__
+        for referrer in gc.get_referrers(value)
+        if referrer is not owner and not isinstance(referrer, FrameType)
+    ]
+
+
+async def _turn(mode: str, cache_size: int) -> None:
+    envelope_aead = StubEnvelopeAEAD()
+    oauth_session = StubOAuthSession()
+    credential = Credential(
+        envelope_aead=envelope_aead,
+        oauth_session=oauth_session,
+        access_token_cache_size=cache_size,
+    )
+
+    async def use_token(tool_context: ToolContext) -> str:
+        """Use the user's access token."""
+        access_token = await credential.get_access_token_from_context(
+            tool_context=tool_context, state_key=STATE_KEY
+        )
+        assert access_token == oauth_session.access_token
+        if mode == "error":
+            raise RuntimeError("tool failed")
+        if mode == "cancel":
+            await asyncio.sleep(10)
+        return "ok"
+
+    agent = Agent(
+        name="agent",
+        model=ToolCallLlm(model="fake"),
+        tools=[use_token],
+        after_agent_callback=credential.clear_invocation,
+    )
+    client = AgentClient(InMemorySessionService(), "check", agent)
+    agent_session = await client.create_session("user", state={STATE_KEY: "encrypted"})
+
+    async def respond() -> str:
+        with credential.invocation_scope():
+            return await agent_session.get_response("hi")
+
+    if mode == "cancel":
+        task = asyncio.ensure_future(respond())
+        await asyncio.sleep(0.2)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    else:
+        await respond()
+
+    refresh_holders = _holders(envelope_aead.refresh_token, envelope_aead.__dict__)
+    cache_entries = credential._access_tokens._entries if credential._access_tokens else None
+    access_holders = _holders(oauth_session.access_token, oauth_session.__dict__)
+    if cache_entries:
+        # Only the cache's (expires_at, token) entry may remain
+        access_holders = [h for h in access_holders if h != "tuple"]
+    assert not credential._invocations, f"{mode}: invocation memo left behind"
+    assert not refresh_holders, f"{mode}: refresh token still held by {refresh_holders}"
+    assert not access_holders, f"{mode}: access token still held by {access_holders}"
+    print(
+        f"{mode:<7} cache={'on' if cache_size else 'off'}: "
+        f"no plaintext left{' outside the cache' if cache_size else ''}"
+    )
+
+
+async def main() -> None:
+    logging.disable(logging.CRITICAL)
+    for cache_size in (0, 1024):
+        for mode in ("ok", "error", "cancel"):
+            await _turn(mode, cache_size)
+    print("ok")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,185 @@
+"""
+Check that abandoned requests stop consuming dependency calls.
+
+Drives the request deadline/cancellation context against stand-in
+dependencies (no Google services needed) and exits non-zero on failure:
+
+- a run of sequential outbound calls stops once the client disconnects
+  or the deadline passes, instead of running to completion
+- a token refresh stops retrying once its request is abandoned
+- a request sharing a token refresh with an abandoned one still gets
+  its token
+
+Run with:
+
+    uv run script/check_request_cancellation.py
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from util.credential.credential import Credential  # noqa: E402
+from util.deadline.deadline import (  # noqa: E402
+    DeadlineExceededError,
+    RequestCancelledError,
+    RequestContext,
+    run_request,
+)
+from util.resilience.resilience import Dependency  # noqa: E402
+
+
+class CountingDependency:
+    def __init__(self, latency: float, fail: bool = False) -> None:
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+
+    async def __call__(self) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.fail:
+            raise ConnectionError("injected failure")
+        return "ok"
+
+
+class StubEnvelopeAEAD:
+    def decrypt_token(self, encrypted_token: str, user_id: str) -> str:
+        return "refresh-token"
+
+
+class StubOAuthSession:
+    def __init__(self, latency: float, failures: int) -> None:
+        self.latency = latency
+        self.failures = failures
+        self.calls = 0
+
+    def refresh_token(self, refresh_token: str) -> dict:
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.calls <= self.failures:
+            raise ConnectionError("injected failure")
+        return {"access_token": "access-token", "expires_in": 3600}
+
+
+def _disconnect_after(seconds: float):
+    return lambda: asyncio.sleep(seconds)
+
+
+async def _agent_run(dependency: Dependency, stand_in: CountingDependency, steps: int) -> str:
+    for _ in range(steps):
+        await dependency.call(stand_in)
+    return "done"
+
+
+async def check_run_stops_on_disconnect() -> None:
+    baseline = CountingDependency(0.05)
+    await _agent_run(Dependency("baseline", timeout=1.0, hedge=False), baseline, 20)
+
+    stand_in = CountingDependency(0.05)
+    dependency = Dependency("disconnect", timeout=1.0, hedge=False)
+    try:
+        await run_request(
+            _agent_run(dependency, stand_in, 20),
+            RequestContext(),
+            disconnected=_disconnect_after(0.12),
+        )
+        raise AssertionError("expected RequestCancelledError")
+    except RequestCancelledError:
+        pass
+    calls = stand_in.calls
+    await asyncio.sleep(0.3)
+    assert stand_in.calls == calls, "calls continued after disconnect"
+    assert calls <= 3, f"{calls} calls made after a 120ms disconnect"
+    print(f"disconnect: {calls} calls vs {baseline.calls} without cancellation")
+
+
+async def check_run_stops_at_deadline() -> None:
+    stand_in = CountingDependency(0.05)
+    dependency = Dependency("deadline", timeout=1.0, hedge=False)
+    started = time.monotonic()
+    try:
+        await run_request(_agent_run(dependency, stand_in, 20), RequestContext(0.2))
+        raise AssertionError("expected DeadlineExceededError")
+    except DeadlineExceededError:
+        pass
+    elapsed = time.monotonic() - started
+    calls = stand_in.calls
+    await asyncio.sleep(0.3)
+    assert stand_in.calls == calls, "calls continued after the deadline"
+    assert elapsed < 0.3, f"deadline of 200ms took {elapsed * 1000:.0f}ms"
+    print(f"deadline:   {calls} calls, gave up after {elapsed * 1000:.0f}ms")
+
+
+def _credential(oauth_session: StubOAuthSession) -> Credential:
+    return Credential(
+        envelope_aead=StubEnvelopeAEAD(),
+        oauth_session=oauth_session,
+        token_dependency=Dependency(
+            "token_endpoint", timeout=1.0, hedge=False, max_attempts=5, backoff_base=0.1
+        ),
+    )
+
+
+async def check_refresh_retries_stop() -> None:
+    baseline = StubOAuthSession(0.05, failures=100)
+    await _credential(baseline).get_access_token("user", "encrypted")
+
+    oauth_session = StubOAuthSession(0.05, failures=100)
+    credential = _credential(oauth_session)
+    try:
+        await run_request(
+            credential.get_access_token("user", "encrypted"),
+            RequestContext(),
+            disconnected=_disconnect_after(0.03),
+        )
+        raise AssertionError("expected RequestCancelledError")
+    except RequestCancelledError:
+        pass
+    await asyncio.sleep(1.0)
+    assert oauth_session.calls == 1, f"{oauth_session.calls} refresh attempts"
+    print(
+        f"refresh:    {oauth_session.calls} attempt vs {baseline.calls} "
+        "for a failing token endpoint"
+    )
+
+
+async def check_shared_refresh_survives() -> None:
+    # The refresh started by the abandoned request fails once and is
+    # dropped while backing off; the other request has to redo it
+    oauth_session = StubOAuthSession(0.05, failures=1)
+    credential = _credential(oauth_session)
+    abandoned = asyncio.ensure_future(
+        run_request(
+            credential.get_access_token("user", "encrypted"),
+            RequestContext(),
+            disconnected=_disconnect_after(0.06),
+        )
+    )
+    await asyncio.sleep(0.01)
+    kept = await run_request(
+        credential.get_access_token("user", "encrypted"), RequestContext()
+    )
+    assert kept == "access-token", kept
+    assert isinstance(
+        (await asyncio.gather(abandoned, return_exceptions=True))[0],
+        RequestCancelledError,
+    )
+    print(f"shared:     token delivered, refresh_calls={oauth_session.calls}")
+
+
+async def main() -> None:
+    logging.disable(logging.CRITICAL)
+    await check_run_stops_on_disconnect()
+    await check_run_stops_at_deadline()
+    await check_refresh_retries_stop()
+    await check_shared_refresh_survives()
+    print("ok")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())